@@ -1,37 +1,261 @@
 class ExchangeRate:
 
-  def __init__(self, currencies={'USD'}, fromDate=202202240455):
+  def __init__(self, currencies={'USD'}, fromDate=202202240455,
+               storage='exchangerates.db', workers=8, attempts=5, backoff=1.,
+               timeout=10., cooldown=600, failures=3):
+    """
+    Args:
+      currencies (set): ISO codes of currencies of interest
+      storage (str): path to the SQLite file where fetched rates are kept
+      workers (int): maximum amount of simultaneous requests to the NBU website
+      attempts (int): maximum amount of requests for a single date
+      backoff (float): delay in seconds after the first failed request, it is
+                       doubled after each next one
+      timeout (float): seconds to wait for the NBU website in a request
+      cooldown (float): seconds after a failed date when the NBU website is
+                        not requested and the stored rates are used
+      failures (int): consecutive failed dates those stop the bulk update
+    """
 
+    import time
     import datetime
+    import sqlite3
+    import concurrent.futures
     import requests
-    from bs4 import BeautifulSoup
+    import numpy
+    import pandas
+    import htmlparse
+    self.time = time
     self.dt = datetime
+    self.futures = concurrent.futures
     self.requests = requests
-    self.BS = BeautifulSoup
+    self.np = numpy
+    self.pd = pandas
+    self.parse = htmlparse.table_rows
 
     self.fromDate = self.dt.date(year=2022, month=2, day=24)
     self.previousDate = self.fromDate - self.dt.timedelta(days=1)
+    self.workers = workers
+    self.attempts = attempts
+    self.backoff = backoff
+    self.timeout = timeout
+    self.cooldown = cooldown
+    self.failures = failures
+    # moment of the last failed date, None after a success
+    self.failed = None
+    self.currentRate = None
+    # True when the current rate is taken from the storage instead of the NBU
+    self.stale = False
+    # rates are stored as a date -> rate dictionary for each currency
     self.currencies = dict()
     for currency in currencies:
-      self.currencies[currency.upper()] = set()
+      self.currencies[currency.upper()] = dict()
+    # aligned daily frame of all currencies, rebuilt on demand
+    self.frame = None
+
+    self.storage = sqlite3.connect(storage)
+    self.storage.execute(
+      'CREATE TABLE IF NOT EXISTS rates ('
+      'date TEXT NOT NULL, currency TEXT NOT NULL, rate REAL NOT NULL, '
+      'PRIMARY KEY (date, currency))'
+    )
+    self._read_rates_()
     # self.update_exchange_rates()
 
+  def _read_rates_(self):
+    """
+    Loads already fetched rates of the currencies of interest from the storage.
+    """
+
+    for currency in self.currencies.keys():
+      for date, rate in self.storage.execute(
+          'SELECT date, rate FROM rates WHERE currency = ?', (currency,)):
+        self.currencies[currency][self.dt.date.fromisoformat(date)] = rate
+
+  def _write_rates_(self, date, rates):
+    """
+    Stores rates of a date both in the memory and in the storage.
+
+    Args:
+      date (datetime.date): date of the rates
+      rates (dict): currency -> exchange rate
+    """
+
+    for currency in rates.keys():
+      self.currencies[currency][date] = rates[currency]
+    self.frame = None
+    with self.storage:
+      self.storage.executemany(
+        'INSERT OR REPLACE INTO rates (date, currency, rate) VALUES (?, ?, ?)',
+        [(date.isoformat(), code, rate) for code, rate in rates.items()]
+      )
+
+  def get_history(self, currency='USD'):
+    """
+    Returns the stored history of a currency sorted by date.
+
+    Args:
+      currency (str): ISO code of the currency
+
+    Returns:
+      tuple: numpy arrays of dates (datetime64[D]) and exchange rates
+    """
+
+    rows = self.storage.execute(
+      'SELECT date, rate FROM rates WHERE currency = ? ORDER BY date',
+      (currency.upper(),)
+    ).fetchall()
+    dates = self.np.array([row[0] for row in rows], dtype='datetime64[D]')
+    rates = self.np.array([row[1] for row in rows], dtype=float)
+    return dates, rates
+
+  def get_rates(self, start=None, end=None, fill=True):
+    """
+    Returns exchange rates of all currencies of interest aligned by date. Days
+    without published rates (weekends, holidays) take the previous rate.
+
+    Args:
+      start (date): optional first date of the range
+      end (date): optional last date of the range
+      fill (bool): if False, days without published rates are NaN
+
+    Returns:
+      pandas.DataFrame: daily rates indexed by date, a column per currency
+    """
+
+    if self.frame is None:
+      frame = self.pd.DataFrame({
+        code: self.pd.Series(rates, dtype=float)
+        for code, rates in self.currencies.items()
+      })
+      frame.index = self.pd.to_datetime(frame.index)
+      frame = frame.sort_index()
+      if len(frame.index) > 0:
+        frame = frame.asfreq('D')
+      self.frame = frame
+
+    start = None if start is None else self.pd.Timestamp(start)
+    end = None if end is None else self.pd.Timestamp(end)
+    frame = self.frame.loc[start:end]
+    return frame.ffill() if fill else frame
+
+  def get_basket_rates(self, start=None, end=None, fill=True):
+    """
+    Returns basket exchange rates where each currency represented by the same
+    value, i.e. harmonic mean of the rates.
+
+    Args:
+      start (date): optional first date of the range
+      end (date): optional last date of the range
+      fill (bool): if False, days without published rates are NaN
+
+    Returns:
+      pandas.Series: daily basket rates indexed by date
+    """
+
+    frame = self.get_rates(start, end, fill)
+    # exchange_rate = amount_exchange_rates / Sum(1/exchange_rate_i)
+    return (len(frame.columns) / (1 / frame).sum(axis=1, skipna=False)).round(4)
+
+  def convert(self, frame, currency=None, price='price', time='time',
+              origin='unix'):
+    """
+    Converts UAH prices to a currency of interest, or to the basket if the
+    currency is not set, by a single join on the date of the deal.
+
+    Args:
+      frame (pandas.DataFrame): deals with a price column in UAH and a time
+                                column in seconds since the origin
+      currency (str): ISO code of the currency
+      price (str): name of the price column
+      time (str): name of the time column
+      origin (str): origin of the time column, e.g. '2020-01-01' for the
+                    kuna.py deltatime()
+
+    Returns:
+      pandas.Series: converted prices with the index of the frame
+    """
+
+    rates = self.get_basket_rates() if currency is None else \
+            self.get_rates()[currency.upper()]
+    rates = rates.rename('rate').rename_axis('date').reset_index()
+    # pandas may pick different resolutions for the keys, merge_asof needs one
+    rates['date'] = rates['date'].astype('datetime64[ns]')
+    deals = self.pd.DataFrame({
+      'date': self.pd.to_datetime(frame[time], unit='s', origin=origin)
+                .astype('datetime64[ns]'),
+      'price': frame[price].to_numpy(dtype=float),
+      'order': self.np.arange(len(frame.index)),
+    }).sort_values('date')
+    deals = self.pd.merge_asof(deals, rates, on='date').sort_values('order')
+    return self.pd.Series(
+      (deals['price'] / deals['rate']).to_numpy(), index=frame.index
+    )
+
+  def _fetch_rates_(self, date):
+    """
+    Requests exchange rates on the date until all currencies of interest are
+    received with non zero values. The amount of requests is limited by
+    self.attempts and the delay between them grows exponentially.
+
+    Args:
+      date (datetime.date): date of interest
+
+    Returns:
+      dict: currency -> exchange rate, or None if all attempts failed
+    """
+
+    delay = self.backoff
+    for attempt in range(self.attempts):
+      if attempt > 0:
+        self.time.sleep(delay)
+        delay *= 2
+      rates = self.get_exchange_rates(date)
+      # as we do not allowed divide by 0
+      if (len(rates) == len(self.currencies.keys())) and \
+         (0 not in rates.values()):
+        return rates
+    return None
+
+  def _last_rates_(self):
+    """
+    Returns the latest stored rates where all currencies of interest present.
+
+    Returns:
+      dict: currency -> exchange rate, or None if nothing is stored
+    """
+
+    dates = None
+    for rates in self.currencies.values():
+      dates = set(rates.keys()) if dates is None else dates & set(rates.keys())
+    if not dates:
+      return None
+    date = max(dates)
+    return {code: rates[date] for code, rates in self.currencies.items()}
+
   def get_current_rate(self):
+    """
+    Returns the basket exchange rate for today. If the NBU website does not
+    respond, the latest stored rates are used and self.stale is set to True.
+
+    Returns:
+      float: basket exchange rate, or None if there is no data at all
+    """
 
     today = self.dt.date.today()
-    if self.previousDate != today:
-
-      rates = None
-      while True:
-        rates = self.get_exchange_rates(today)
-        flag = len(rates) > 0
-        # as we do not allowed divide by 0
-        for value in rates.values():
-          if value == 0:
-            flag = False
-            break
-        if flag:
-          break
+    # while the website is down the stale rate is served without requests
+    if (self.previousDate != today) and not (self.stale and self._cooling_()):
+
+      rates = self._fetch_rates_(today)
+      self.stale = rates is None
+      self.failed = self.time.time() if rates is None else None
+      if rates is None:
+        rates = self._last_rates_()
+        if rates is None:
+          print('There are no exchange rates available')
+          return None
+      else:
+        self._write_rates_(today, rates)
 
       # average exchange rate where each currency represented by the same value
       # exchange_rate = amount_exchange_rates / Sum(1/exchange_rate_i)
@@ -42,28 +266,65 @@ class ExchangeRate:
 
       self.currentRate = len(rates.keys()) / self.currentRate
       self.currentRate = round(self.currentRate, 4)
-      self.previousDate = today
+      # stale rate will be requested again on the next call
+      if not self.stale:
+        self.previousDate = today
 
     return self.currentRate
 
+  def _cooling_(self):
+    """
+    Returns:
+      bool: True during the cooldown after a failed date
+    """
+
+    return (self.failed is not None) and \
+           (self.time.time() - self.failed < self.cooldown)
+
   def update_exchange_rates(self):
     """
-    Checks all past days from the start of the year up to yesterday and, if the
-    data for the date is not present, requests it on the NBU website.
+    Checks all past days from the start of the war up to today and, if the
+    data for the date is not present in the storage, requests it on the NBU
+    website. Missing dates are requested simultaneously. The update stops
+    after self.failures consecutive failed dates and is skipped during the
+    cooldown after them.
     """
 
+    if self._cooling_():
+      print('The NBU website failed recently, the update is skipped')
+      return
+
     day = self.dt.timedelta(days=1)
     today = self.dt.date.today()
-    while today > self.previousDate:
-      self.previousDate += day
-      while True:
-        rates = self.get_exchange_rates(date=self.previousDate)
-        if len(rates) == len(self.currencies.keys()):
-          for currency in rates.keys():
-            self.currencies[currency].add(rates[currency])
-          print(f'Exchange rates for {self.previousDate} were updated')
+    missing = []
+    date = self.fromDate
+    while date <= today:
+      for rates in self.currencies.values():
+        if date not in rates:
+          missing.append(date)
+          break
+      date += day
+
+    with self.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+      futures = [pool.submit(self._fetch_rates_, date) for date in missing]
+      failed = 0
+      for date, future in zip(missing, futures):
+        rates = future.result()
+        # failed dates will be requested on the next run
+        if rates is not None:
+          failed = 0
+          self._write_rates_(date, rates)
+          print(f'Exchange rates for {date} were updated')
+          continue
+        failed += 1
+        print(f'Exchange rates for {date} were not received')
+        if failed >= self.failures:
+          # the website is down, the rest is not requested
+          self.failed = self.time.time()
+          for rest in futures:
+            rest.cancel()
+          print('The update is stopped after %d failed dates' % failed)
           break
-    print(self.currencies)
 
   def get_exchange_rates(self, date):
     """
@@ -83,53 +344,71 @@ class ExchangeRate:
     try:
 
       rates = dict()
-      full_page = self.requests.get(NBU, headers={'User-Agent':header})
-      soup = self.BS(full_page.content, 'html.parser')
-      table = soup.find_all("table")
-      if (len(table) > 0):
-        table = table[0]
-        for row in table.find_all("tr"):
-          code = row.findAll("td",{"data-label": "Код літерний"})
-          if (len(code) > 0):
-            code = code[0].get_text()
-            if code in self.currencies.keys():
-              quantity = row.findAll("td",
-                                    {"data-label":"Кількість одиниць валюти"})
-              quantity = float(quantity[0].get_text())
-              # cost
-              erate = row.findAll("td",{"data-label": "Офіційний курс"})[0]
-              erate = float(erate.get_text().replace(",","."))
-              # exchange rate
-              rates[code] = erate/quantity
+      full_page = self.requests.get(NBU, headers={'User-Agent':header},
+                                    timeout=self.timeout)
+      # only the first table on the page is parsed
+      for row in self.parse(full_page.content):
+        cells = {attrs.get('data-label'): text for tag, attrs, text in row
+                 if tag == 'td'}
+        code = cells.get('Код літерний')
+        if code in self.currencies.keys():
+          quantity = float(cells['Кількість одиниць валюти'])
+          # cost
+          erate = float(cells['Офіційний курс'].replace(',', '.'))
+          # exchange rate
+          rates[code] = erate/quantity
       return rates
-    except self.requests.exceptions.RequestException:
+    # a malformed page is a failed attempt as well as a failed request
+    except (self.requests.exceptions.RequestException, KeyError, ValueError,
+            ZeroDivisionError):
       return {}
 
-  def group_by_month(self):
-    """
-    Groups exchange rates by month and prints them up
-    """
-    # current month and year numbers
-    last_day, last_month, last_year = parse_date(get_current_date())
-    if (last_day == 1) and (last_month == 1):
-      last_month = 12
-      last_year -= 1
-    for currencyName in list(self.rates):
-      # to print the currency name in work
-      print(currencyName)
-      rates = self.rates[currencyName]
-      List = list(rates)
-      # for each month up to current
-      for m in range(1,last_month+1):
-        # to average exchange rates
-        N, S = 0, 0
-        # for each day
-        for d in range(1,32):
-          date = get_date(d, m, last_year)
-          # if present
-          if date in List:
-            N += 1
-            S += rates[date]
-        # print out averaged rates
-        if (N > 0):
-          print("%d: %.4f"% (m, 0.0001*float(0.5 + 10000*S/N)))
\ No newline at end of file
+  def group_by(self, freq, currency=None, start=None, end=None):
+    """
+    Averages published exchange rates over calendar periods.
+
+    Args:
+      freq (str): pandas offset alias of the period, e.g. 'MS' or 'W-MON'
+      currency (str): ISO code of the currency, the basket if not set
+      start (date): optional first date of the range
+      end (date): optional last date of the range
+
+    Returns:
+      tuple: numpy arrays of period starts (datetime64[D]) and average rates
+    """
+
+    rates = self.get_basket_rates(start, end, fill=False) if currency is None \
+            else self.get_rates(start, end, fill=False)[currency.upper()]
+    rates = rates.resample(freq, closed='left', label='left').mean()
+    rates = rates.dropna().round(4)
+    return rates.index.to_numpy(dtype='datetime64[D]'), rates.to_numpy()
+
+  def group_by_month(self, currency=None, start=None, end=None):
+    """
+    Averages exchange rates by month.
+
+    Args:
+      currency (str): ISO code of the currency, the basket if not set
+      start (date): optional first date of the range
+      end (date): optional last date of the range
+
+    Returns:
+      tuple: numpy arrays of first days of months and average rates
+    """
+
+    return self.group_by('MS', currency, start, end)
+
+  def group_by_week(self, currency=None, start=None, end=None):
+    """
+    Averages exchange rates by week.
+
+    Args:
+      currency (str): ISO code of the currency, the basket if not set
+      start (date): optional first date of the range
+      end (date): optional last date of the range
+
+    Returns:
+      tuple: numpy arrays of Mondays and average rates
+    """
+
+    return self.group_by('W-MON', currency, start, end)
@@ -0,0 +1,200 @@
+import os
+import re
+import time
+
+def _selectolax_rows(content, tag, classes):
+  """
+  Extracts rows of the first matched element with the selectolax backend.
+  """
+
+  from selectolax.parser import HTMLParser
+
+  table = HTMLParser(content).css_first(tag + ''.join('.' + c for c in classes))
+  if table is None:
+    return []
+  return [
+    [(cell.tag, cell.attributes, cell.text()) for cell in row.css('th, td')]
+    for row in table.css('tr')
+  ]
+
+def _lxml_rows(content, tag, classes):
+  """
+  Extracts rows of the first matched element with the lxml backend.
+  """
+
+  import lxml.html
+
+  condition = ''.join(
+    f"[contains(concat(' ', normalize-space(@class), ' '), ' {c} ')]"
+    for c in classes
+  )
+  tables = lxml.html.fromstring(content).xpath(f'//{tag}{condition}')
+  if len(tables) == 0:
+    return []
+  return [
+    [(cell.tag, dict(cell.attrib), cell.text_content()) for cell in
+     row.xpath('./th|./td')]
+    for row in tables[0].iter('tr')
+  ]
+
+def _bs4_rows(content, tag, classes):
+  """
+  Extracts rows of the first matched element with the BeautifulSoup backend.
+  Only elements with the tag are parsed into the tree.
+  """
+
+  from bs4 import BeautifulSoup, SoupStrainer
+
+  soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(tag))
+  # the classes are a subset of the class tokens as for the other backends
+  table = soup.find(lambda element: (element.name == tag) and
+                    set(classes) <= set(element.get('class') or ()))
+  if table is None:
+    return []
+  return [
+    [(cell.name, cell.attrs, cell.get_text()) for cell in
+     row.find_all(['th', 'td'])]
+    for row in table.find_all('tr')
+  ]
+
+_BACKENDS_ = [
+  ('selectolax', _selectolax_rows),
+  ('lxml', _lxml_rows),
+  ('bs4', _bs4_rows),
+]
+"""list: parser backends in order of preference"""
+_CHOSEN_ = dict()
+"""dict: requested backend name -> available backend function"""
+
+def get_backend(name=None):
+  """
+  Picks up the fastest available parser backend.
+
+    Args:
+      name (str): optional name of the required backend ('selectolax', 'lxml'
+                  or 'bs4')
+
+    Returns:
+      function: backend function with the table_rows() signature
+  """
+
+  if name in _CHOSEN_:
+    return _CHOSEN_[name]
+  for backend, function in _BACKENDS_:
+    if name and (name != backend):
+      continue
+    try:
+      function('<table></table>', 'table', ())
+      _CHOSEN_[name] = function
+      return function
+    except ImportError:
+      continue
+  raise ImportError(f'Parser backend {name or "of any kind"} is not available')
+
+_CHARSET_ = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+"""re.Pattern: charset declared in a meta tag of a page"""
+
+def decode(content, encoding=None):
+  """
+  Decodes a page once for all backends, so the text does not depend on the
+  backend guesses (lxml falls back to Latin-1 without a meta charset).
+
+    Args:
+      content (bytes): HTML page
+    or
+      str: already decoded page, returned as is
+      encoding (str): optional encoding, by default the charset of a meta tag
+                      or UTF-8
+
+    Returns:
+      str: decoded page
+  """
+
+  if isinstance(content, str):
+    return content
+  if encoding is None:
+    match = _CHARSET_.search(content[:4096])
+    encoding = match.group(1).decode('ascii') if match else 'utf-8'
+  try:
+    return content.decode(encoding, errors='replace')
+  except LookupError:
+    return content.decode('utf-8', errors='replace')
+
+def table_rows(content, tag='table', classes=(), backend=None, encoding=None):
+  """
+  Extracts rows of the first element with the tag and all the classes on the
+  page. Only the content of the element is processed.
+
+    Args:
+      content (bytes): HTML page
+      tag (str): tag name of the element that contains a table
+      classes (tuple): CSS classes of the element
+      backend (str): optional name of a parser backend
+      encoding (str): optional encoding of the page, see decode()
+
+    Returns:
+      list: rows as lists of cells. Each cell is a (tag, attributes, text)
+            tuple.
+  """
+
+  return get_backend(backend)(decode(content, encoding), tag, classes)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'tests', 'fixtures')
+"""str: directory of the saved pages: nbu_rates.html with the first table
+as parsed by exchangerate.py and inflation.html with the block parsed by
+inflation.py"""
+
+def benchmark(path, tag='table', classes=(), repeat=20):
+  """
+  Measures parse time of a saved page by all available backends, e.g. of
+  the pages in FIXTURES.
+
+    Args:
+      path (str): path to the saved page
+      tag (str): tag name of the element that contains a table
+      classes (tuple): CSS classes of the element
+      repeat (int): amount of repetitions
+
+    Returns:
+      dict: backend name -> average parse time in seconds
+  """
+
+  with open(path, 'rb') as f:
+    content = decode(f.read())
+
+  # the legacy way: full page by BeautifulSoup
+  def full_page(content, tag, classes):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    return [row.find_all(['th', 'td']) for row in soup.find_all('tr')]
+
+  results = dict()
+  for backend, function in _BACKENDS_ + [('bs4 full page', full_page)]:
+    try:
+      start = time.perf_counter()
+      for i in range(repeat):
+        function(content, tag, classes)
+      results[backend] = (time.perf_counter() - start) / repeat
+    except ImportError:
+      continue
+  return results
+
+if __name__ == '__main__':
+
+  import sys
+
+  # python3 htmlparse.py [page.html [tag] [class ...]]
+  args = sys.argv[1:]
+  if args:
+    pages = [(args[0], args[1] if len(args) > 1 else 'table', tuple(args[2:]))]
+  else:
+    pages = [
+      (os.path.join(FIXTURES, 'nbu_rates.html'), 'table', ()),
+      (os.path.join(FIXTURES, 'inflation.html'), 'div',
+       ('idx-block-1120', 'compact-table')),
+    ]
+  for path, tag, classes in pages:
+    print(os.path.basename(path))
+    for backend, seconds in benchmark(path, tag, classes).items():
+      print('%-14s %8.3f ms' % (backend, 1000 * seconds))
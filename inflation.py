@@ -6,8 +6,8 @@ class InflationIndex:
     self.dt = datetime
     import requests
     self.requests = requests
-    from bs4 import BeautifulSoup
-    self.BS = BeautifulSoup
+    import htmlparse
+    self.parse = htmlparse.table_rows
 
     self.indices = dict()
     self._get_indices_()
@@ -26,7 +26,7 @@ class InflationIndex:
         """
         Converts content of the sell to the float or returns 1 for empty cell
         """
-        x = x.get_text().replace(',','.')
+        x = x.replace(',','.')
         if (len(x) > 0):
 
           return 0.001 * int(10 * float(x))
@@ -76,23 +76,22 @@ class InflationIndex:
           'TML, like Gecko) Chrome/81.0.4044.92 Safari/537.36'
           }
       )
-      soup = self.BS(full_page.content, 'html.parser')
-      # we expect only one table on the page
-      table = soup.find_all("div", {"class": "idx-block-1120 compact-table"})
-      assert(len(table) == 1)
-      table = table.pop()
+      # only the first block with the table is parsed
+      rows = self.parse(
+        full_page.content, 'div', ('idx-block-1120', 'compact-table')
+      )
+      assert(len(rows) > 0)
 
-      rows = table.find_all("tr")
       # headers should be 14: first is blank, 12 months plus annual
-      assert(14 == len(rows.pop(0).find_all("th")))
+      assert(14 == len([c for c in rows.pop(0) if c[0] == 'th']))
 
       for row in rows:
         # here should be a year and annual index
-        columns = row.find_all("th")
+        columns = [text for tag, attrs, text in row if tag == 'th']
         assert(2 == len(columns))
-        year = int(columns[0].get_text())
+        year = int(columns[0])
         self.indices[year] = [number(columns[1])] + [0] * 12
-        columns = row.find_all("td")
+        columns = [text for tag, attrs, text in row if tag == 'td']
         # we expect 12 month in a year. Should we?
         assert(12 == len(columns))
         for i in range(len(columns)):
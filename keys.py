@@ -1,26 +1,53 @@
+import io
 import os
 import sys
-import random
-import string
+import time
+import json
+import socket
+import hashlib
 import getpass
-# requires pip3 install pycrypto
+import threading
+# requires pip3 install pycryptodome
 from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
 
 _PATH_TO_THE_FILE_ = ".key"
 """str: path to the file with stored keys"""
-_STRING_LENGTH_ = 64
-"""int: number of chars in a string"""
 _BLOCK_LENGTH_ = 8
 """int: length of a block that code an int"""
 _MAX_LENGTH_ = 3
 """int: maximum length of an int"""
-
-def get_input(field_name):
+_MAGIC_ = b"KUNAKEY"
+"""bytes: signature of the compact key file"""
+_VERSION_ = 1
+"""int: version of the compact key file format"""
+_SALT_LENGTH_ = 16
+"""int: length of the KDF salt"""
+_NONCE_LENGTH_ = 12
+"""int: length of the AES-GCM nonce"""
+_TAG_LENGTH_ = 16
+"""int: length of the AES-GCM authentication tag"""
+_KDF_ = {"n": 2**15, "r": 8, "p": 1, "dklen": 32, "maxmem": 2**26}
+"""dict: scrypt parameters of the key derivation"""
+_PASSWORD_ENV_ = "KUNA_KEY_PASSWORD"
+"""str: environment variable with the password"""
+_PASSWORD_FD_ENV_ = "KUNA_KEY_PASSWORD_FD"
+"""str: environment variable with a file descriptor to read the password from"""
+_AGENT_ENV_ = "KUNA_KEY_AGENT"
+"""str: environment variable with a path to an agent Unix socket that sends the
+password on connection"""
+_KEYS_ = None
+"""dict: keys decrypted by get_keys() and cached for the process lifetime"""
+_KEYS_LOCK_ = threading.Lock()
+"""threading.Lock: guards the decryption in get_keys()"""
+
+def get_input(field_name, repeat=True):
   """
   Requests an input and its repetition. Check the correctness.
 
     Args:
       s (str): name of the requesting input.
+      repeat (bool): requests the repetition if True.
 
     Returns:
       str: input sting
@@ -69,24 +96,28 @@ def get_input(field_name):
     print(f'Error during the {field_name} requesting: ', error)
   else:
 
-    check = ''
+    check = '' if repeat else _in
     while (check != _in):
 
       check = check_input(getpass.getpass(f'Please repeat the {field_name}: '))
 
   return _in
 
-def get_pass():
+def get_pass(pswd=None, repeat=True):
   """
   Requests a password and its repetition. Check the correctness and minimal
   length of the password. Returns 16 symbols in a binary encoding.
 
+    Args:
+      pswd (str): password known in advance. Requested if None.
+      repeat (bool): requests the repetition if True.
+
     Returns:
       bytes: 16 symbols length bytearray.
   """
 
   # password
-  pswd = get_input('password')
+  if pswd is None: pswd = get_input('password', repeat)
 
   # if the string is not binary
   if ('encode' in dir(pswd)): pswd = pswd.encode()
@@ -94,156 +125,116 @@ def get_pass():
 
   return pswd[:16]
 
-def write_keys():
-  """
-  Encode and write keys to the file.
+def derive_key(pswd, salt):
   """
+  Derives an AES-256 key from a password.
 
-  def get_a_char():
-    """
-    Helper function that returns a printable char.
-
-      Returns:
-        str: one printable char.
-    """
-
-    return string.printable[random.randint(0, 62)]
-
-  def get_a_byte():
-    """
-    Returns a byte.
-
-      Returns:
-        bytes: single byte.
-    """
-
-    return get_a_char().encode()
-
-  def form_byte_string(length):
-    """
-    Forms a random byte string with required length.
-
-      Args:
-        length (int): length of the string
-
-      Returns:
-        bytes: random bytearray of required length.
-    """
-
-    s = b''
-    while len(s) < length:
-
-      s += get_a_byte()
-    return s
-
-  def hide_int(number, max_length=_MAX_LENGTH_, block_length=_BLOCK_LENGTH_):
-    """
-    Forms a byte string of required length that stores the number in a random
-    symbols.
-
-      Args:
-        number (int): number that we should store
-        max_length (int): optional parameter that changes the length of the
-                          mindful block
-        block_length (int): optional parameter that means the length of the
-                            number block in the mindful block
-
-      Returns:
-        bytes: bytearray with stored number.
-    """
-
-    # form the string
-    result = '%d' % number
-
-    # adds arbitrary zeros to the head to form a sting with required length
-    while len(result) < max_length: result = '0' + result
-
-    # adds arbitrary symbols to the head to form a block of required length
-    for i in range(block_length - max_length): result += get_a_char()
-
-    # mirrors and makes binary
-    result = result[::-1].encode()
-
-    # adds arbitrary symbols to fulfill the string
-    result += form_byte_string(_STRING_LENGTH_ - len(result))
-
-    return result
-
-  def form_length(s):
-    """
-    Helper function that hides length of a string.
-
-      Args:
-        s (str): string.
-
-      Returns:
-        bytes: bytearray with a hided length of the string.
-    """
+    Args:
+      pswd (str): password.
+      salt (bytes): random salt stored in the file.
 
-    return hide_int(len(s))
+    Returns:
+      bytes: 32 bytes key.
+  """
 
-  def write_block(f, msg):
-    """
-    Write a message as a sequence of hided integer numbers.
+  return hashlib.scrypt(pswd.encode(), salt=salt, **_KDF_)
 
-      Args:
-        f (file): file opened for write of append bite strings
-        msg (str): message to hide
+def write_private(path, data):
+  """
+  Atomically write data to a file readable only by the owner. The data goes
+  to a temporary file created with mode 0600, is flushed to the disk and
+  replaces the file, so an interrupted write keeps the previous file.
 
-      Returns:
-        bytes: bytearray with stored number.
-    """
-    # writes length
-    f.write(b'%s\n'%form_length(msg))
+    Args:
+      path (str): path to the file.
+      data (bytes): content of the file.
+  """
 
-    # writes the message
-    for symbol in msg: f.write(b'%s\n'%hide_int(symbol))
+  temporary = '%s.%d.tmp' % (path, os.getpid())
+  fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  try:
+    with os.fdopen(fd, "wb") as file_out:
+      file_out.write(data)
+      file_out.flush()
+      os.fsync(file_out.fileno())
+    os.replace(temporary, path)
+  except BaseException:
+    if os.path.exists(temporary):
+      os.remove(temporary)
+    raise
+
+def write_keys(public=None, private=None, pswd=None):
+  """
+  Encrypt and write keys to the file in the compact format:
+  magic + version + salt + nonce + ciphertext + tag. The header is
+  authenticated together with the ciphertext.
 
-  def form_a_message():
-    """
-    Form a message to store from public and private keys.
+    Args:
+      public (str): public key. Requested if None.
+      private (str): private key. Requested if None.
+      pswd (str): password. Requested if None.
+  """
 
-      Returns:
-        str: string with stored number.
-    """
+  if public is None: public = get_input('public key')
+  if private is None: private = get_input('private key')
+  if pswd is None: pswd = get_input('password')
 
-    pub = get_input('public key')
-    pri = get_input('private key')
+  salt = get_random_bytes(_SALT_LENGTH_)
+  nonce = get_random_bytes(_NONCE_LENGTH_)
+  header = _MAGIC_ + bytes([_VERSION_]) + salt + nonce
 
-    # result string
-    result = ''
-    # mesh up two keys and adjust their length to the biggest one
-    for i in range(max([len(pub), len(pri)])):
-      result += pub[i] if (i < len(pub)) else get_a_char()
-      result += pri[i] if (i < len(pri)) else get_a_char()
-    # adds length of the public key to the front
-    result = hide_int(len(pub))[:_BLOCK_LENGTH_].decode() + result
-    # adds length of the private key to the back
-    result += hide_int(len(pri))[:_BLOCK_LENGTH_].decode()
+  cipher = AES.new(derive_key(pswd, salt), AES.MODE_GCM, nonce=nonce,
+                   mac_len=_TAG_LENGTH_)
+  cipher.update(header)
+  ciphertext, tag = cipher.encrypt_and_digest(
+    json.dumps({"public": public, "private": private}).encode()
+  )
 
-    return result
+  write_private(_PATH_TO_THE_FILE_, header + ciphertext + tag)
 
-  # creates a file where the key will be written
-  file_out = open(_PATH_TO_THE_FILE_, "wb")
+  print('Keys were written')
 
-  # create an initialization vector
-  IV = form_byte_string(AES.block_size)
-  # and store it
-  write_block(file_out, IV)
+def load_compact_keys(data, pswd):
+  """
+  Decrypt keys stored in the compact format.
 
-  # creates cipher
-  cipher = AES.new(get_pass(), AES.MODE_CFB, IV)
-  # and write the message
-  write_block(file_out, cipher.encrypt(form_a_message().encode()))
+    Args:
+      data (bytes): content of the file.
+      pswd (str): password.
 
-  print('Keys were written')
+    Returns:
+      tuple: restored public and private keys.
+  """
 
-def load_keys():
+  offset = len(_MAGIC_)
+  version = data[offset]
+  if version != _VERSION_:
+    raise ValueError(f'Unsupported key file version {version}')
+  offset += 1
+  salt = data[offset:offset + _SALT_LENGTH_]
+  offset += _SALT_LENGTH_
+  nonce = data[offset:offset + _NONCE_LENGTH_]
+  offset += _NONCE_LENGTH_
+
+  cipher = AES.new(derive_key(pswd, salt), AES.MODE_GCM, nonce=nonce,
+                   mac_len=_TAG_LENGTH_)
+  cipher.update(data[:offset])
+  # raises ValueError for a wrong password or a damaged file
+  keys = json.loads(cipher.decrypt_and_verify(
+    data[offset:-_TAG_LENGTH_], data[-_TAG_LENGTH_:]
+  ))
+
+  return (keys["public"], keys["private"])
+
+def load_keys(pswd=None):
   """
   Restore public and private keys from the file.
 
+    Args:
+      pswd (str): password. Requested once if None.
+
     Returns:
-      dict: dictionary with restored public and private keys.
+      tuple: restored public and private keys.
   """
 
   def parse_line(s):
@@ -260,16 +251,6 @@ def load_keys():
     result = s[_BLOCK_LENGTH_-_MAX_LENGTH_:_BLOCK_LENGTH_]
     return int(result[::-1])
 
-  def get_a_byte(c):
-    """
-    Helper function to cast a byte from int.
-
-      Returns:
-        dict: dictionary with restored public and private keys.
-    """
-
-    return bytes([c])
-
   def parse_block(f):
     """
     Restore a byte string from the block.
@@ -281,14 +262,10 @@ def load_keys():
       bytes: stored bytearray.
     """
 
-    # result string
-    result = b''
     # amount of lines in the block
-    count = parse_line(file_in.readline())
+    count = parse_line(f.readline())
     # get each symbol
-    for i in range(count): result += get_a_byte(parse_line(f.readline()))
-
-    return result
+    return bytes([parse_line(f.readline()) for i in range(count)])
 
   def process_message(msg):
     """
@@ -314,12 +291,121 @@ def load_keys():
 
   if os.path.exists(_PATH_TO_THE_FILE_):
 
-    file_in = open(_PATH_TO_THE_FILE_, "rb")
-    cipher = AES.new(get_pass(), AES.MODE_CFB, parse_block(file_in))
+    if pswd is None: pswd = get_input('password', repeat=False)
+    with open(_PATH_TO_THE_FILE_, "rb") as file_in:
+      data = file_in.read()
+    if data.startswith(_MAGIC_):
+
+      keys = load_compact_keys(data, pswd)
+    else:
+
+      # legacy format: each byte is hidden in a line
+      file_in = io.BytesIO(data)
+      cipher = AES.new(get_pass(pswd), AES.MODE_CFB, parse_block(file_in))
+      keys = process_message(cipher.decrypt(parse_block(file_in)).decode())
     print('Keys were read')
-    return process_message(cipher.decrypt(parse_block(file_in)).decode())
+    return keys
   else:
 
     print('There are no keys stored')
     return None
 
+def migrate_keys(pswd=None):
+  """
+  Rewrite the legacy key file in the compact format with the same password.
+  Prints size and load time of the file in both formats.
+
+    Args:
+      pswd (str): password. Requested once if None.
+  """
+
+  if pswd is None: pswd = get_input('password', repeat=False)
+
+  def measure():
+    """
+    Helper function that loads the keys and measures the file.
+
+      Returns:
+        tuple: keys, file size in bytes and load time in seconds.
+    """
+
+    start = time.perf_counter()
+    keys = load_keys(pswd)
+    return keys, os.path.getsize(_PATH_TO_THE_FILE_), time.perf_counter() - start
+
+  keys, size, seconds = measure()
+  if keys is None:
+    return
+  with open(_PATH_TO_THE_FILE_, "rb") as file_in:
+    legacy = file_in.read()
+  if legacy.startswith(_MAGIC_):
+    print('Keys are already stored in the compact format')
+    return
+  # the key file is replaced at once, there is always one to load
+  write_private(_PATH_TO_THE_FILE_ + '.legacy', legacy)
+  write_keys(keys[0], keys[1], pswd)
+  new_keys, new_size, new_seconds = measure()
+  assert(new_keys == keys)
+
+  print(f'Legacy format: {size} bytes, loaded in {1000*seconds:.1f} ms')
+  print(f'Compact format: {new_size} bytes, loaded in {1000*new_seconds:.1f} ms')
+  print(f'The legacy file was kept as {_PATH_TO_THE_FILE_}.legacy')
+
+def read_password():
+  """
+  Looks for a password of a headless process. Sources are checked in order:
+  environment variable, file descriptor, agent socket.
+
+    Returns:
+      str: password or None if no source is configured.
+  """
+
+  if _PASSWORD_ENV_ in os.environ:
+
+    return os.environ[_PASSWORD_ENV_]
+  elif _PASSWORD_FD_ENV_ in os.environ:
+
+    with os.fdopen(int(os.environ[_PASSWORD_FD_ENV_]), 'r') as f:
+      return f.readline().rstrip('\n')
+  elif _AGENT_ENV_ in os.environ:
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as agent:
+      agent.connect(os.environ[_AGENT_ENV_])
+      chunks = []
+      while True:
+        chunk = agent.recv(4096)
+        if not chunk: break
+        chunks.append(chunk)
+    return b''.join(chunks).decode().rstrip('\n')
+  else:
+
+    return None
+
+def get_keys():
+  """
+  Restore public and private keys once per process. The password is taken by
+  read_password() or requested from the terminal if there is one.
+
+    Returns:
+      dict: {
+        "public" : "",
+        "private" : ""
+      } or None if keys could not be restored.
+  """
+
+  global _KEYS_
+
+  with _KEYS_LOCK_:
+
+    if _KEYS_ is None:
+
+      pswd = read_password()
+      if (pswd is None) and (not sys.stdin.isatty()):
+
+        print('There is no password source for a headless process')
+        return None
+      keys = load_keys(pswd)
+      if keys:
+        _KEYS_ = {"public": keys[0], "private": keys[1]}
+  return _KEYS_
+
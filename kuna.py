@@ -1,14 +1,21 @@
 
 import os
 import time
+import argparse
 import requests
+import multiprocessing
 
 import numpy as np
 import pandas as pd
 
+from storage import TRADE_DTYPE, SQLiteStorage, Retention, SegmentArchive
+from pubsub import Publisher
+
 SECONDS_IN_A_WEEK = 604800
 """int: number of seconds in a week. Used for storing and forecasting interval
 specification"""
+TRADES_LIMIT = 1000
+"""int: maximum amount of trades in a single response of the server"""
 
 def deltatime(time):
   """
@@ -144,17 +151,26 @@ class Coins:
       is_user_method=True
     )
 
-  def get_trades_history(self, ticker):
+  def get_trades_history(self, ticker, since=None):
     """
     Get trades history for the coins pair
 
     Args:
       ticker (str): the market name
+      since (int): optional ID of a trade, only trades after it are returned
+        in ascending order
 
     Returns:
       dict: dictionary with recent history of executed orders.
     """
-    return self.request('trades?market=%s'%ticker)
+    if since is None:
+      return self.request('trades?market=%s'%ticker)
+    return self.request('trades', args={
+      'market': ticker,
+      'from': since,
+      'order_by': 'asc',
+      'limit': TRADES_LIMIT,
+    })
 
   def get_user_trade_history(self, ticker):
     """
@@ -181,6 +197,15 @@ class Coins:
     """
     return self.request('members/me', is_user_method=True)
 
+  def now(self):
+    """
+    Current time by the server clock if it is set, by the local clock if not.
+
+    Returns:
+      float: time stamp in Unix format
+    """
+    return self.clock.time() if self.clock else time.time()
+
   def get_file_name(self, ticker):
     """
     Helper function. Returns the file name where the history is stored.
@@ -216,7 +241,7 @@ class Coins:
     """
     if is_user_method:
       args['access_key'] = self.access_key
-      args['tonce'] = int(time.time() * 1000) # current time in ms
+      args['tonce'] = int(self.now() * 1000) # current time in ms
       args['signature'] = self.generate_signature(method, path, args)
 
     try:
@@ -252,9 +277,15 @@ class Coins:
     msg = msg.encode('ascii')
     return hmac.new(self.secret_key, msg, hashlib.sha256).hexdigest()
 
-  def idle(self):
+  def idle(self, report=None, stop=None):
     """
     Void method that provides an idle mode.
+
+    Args:
+      report (function): optional, called with the health status dictionary
+        after each sweep.
+      stop (multiprocessing.Event): optional, when it is set the collected
+        trades are written and the method returns.
     """
     def ctime():
       """
@@ -267,6 +298,10 @@ class Coins:
 
     time_delta = 60 # s, minimal duration between requests
     time_last = ctime() # s, moment of the last request
+    list_delta = 3600 # s, minimal duration between updates of the list
+    list_last = ctime() # s, moment of the last update of the list
+    checkpoint_delta = 300 # s, minimal duration between checkpoints
+    checkpoint_last = ctime() # s, moment of the last checkpoint
 
     # infinite loop to provide idle mode
     while True:
@@ -276,37 +311,92 @@ class Coins:
       if delta > 0:
         print('%s | Sleep for %d seconds' %
           (time.strftime("%H:%M:%S", time.localtime()), delta))
-        time.sleep(delta)
+        if stop is None:
+          time.sleep(delta)
+        else:
+          stop.wait(delta)
+      if (stop is not None) and stop.is_set():
+        break
       time_last = ctime()
+      # Refresh the list of markets
+      if time_last - list_last >= list_delta:
+        list_last = time_last
+        self.read_rates(self.update_list())
       # Collect statistic
       self.update_rates()
+      if report:
+        report(self.health())
+      self.store_pending()
       if True in list(self.newData.values()):
+        changed = set()
         for key in list(self.rates):
           if self.newData[key]:
             self.newData[key] = False
             self.reduce_rates(key)
             self.write_rates(key)
+            changed.add(key)
+        # compaction may move bars of any market, each is stored
+        for key in changed | self.retention.compact():
+          self.retention.write(key)
+      if time_last - checkpoint_last >= checkpoint_delta:
+        checkpoint_last = time_last
+        self.write_checkpoint()
+
+    # a clean exit: nothing collected is left out of the files
+    self.store_pending()
+    for key in list(self.rates):
+      if self.newData[key]:
+        self.newData[key] = False
+        self.write_rates(key)
+    self.write_checkpoint()
+
+  def health(self):
+    """
+    Health status of the collector.
+
+    Returns:
+      dict: 'time' of the status, 'pid' of the process and 'lag' dictionary
+        with seconds since the last successful fetch of each market.
+    """
+    now = time.time()
+    return {
+      'time': now,
+      'pid': os.getpid(),
+      'lag': {key: now - self.fetched.get(key, 0) for key in list(self.rates)},
+    }
 
   def reduce_rates(self, key):
     """
-    Reduce all transactions those are older than 3 weeks
+    Reduce all transactions those are older than 3 weeks. They are rolled up
+    into bars of the retention tiers and archived if the archive is set.
     """
     IDs = list(self.rates[key])
     IDs.sort()
     first_deal_time = self.rates[key][IDs[-1]]['time'] - 3*SECONDS_IN_A_WEEK
+    expired = []
     for i in range(len(IDs)):
       if (self.rates[key][IDs[i]]['time'] >= first_deal_time):
         break
       else:
-        del self.rates[key][IDs[i]]
+        deal = self.rates[key].pop(IDs[i])
+        expired.append((IDs[i], deal['price'], deal['volume'], deal['funds'],
+                        deal['time'], deal['trend']))
+    if expired:
+      # trades restored from an older checkpoint may be rolled up already
+      expired = self.retention.add(key, np.array(expired, dtype=TRADE_DTYPE))
+      if self.archive and len(expired):
+        self.archive.write(key, expired)
 
-  def read_rates(self):
+  def read_rates(self, keys=None):
     """
     Void helper method that reads stored rates from the relevant files. Void
     because we keep that information in the memory during the script execution.
+
+    Args:
+      keys (list): optional names of the markets, all by default
     """
     # for each coins pair from the list of interest
-    for key in list(self.rates):
+    for key in list(self.rates) if keys is None else keys:
       # file name where exchange rates are stored
       fileName = self.get_file_name(key)
       # if exist
@@ -344,25 +434,117 @@ class Coins:
           self.rates[ticker][ID]['time'],
           self.rates[ticker][ID]['trend']
         ])
-      # pandas services to write an csv file
+      # pandas services to write an csv file, replaced atomically so an
+      # interrupted write does not truncate the history
+      fileName = self.get_file_name(ticker)
       pd.DataFrame( np.array(rates),
         columns=['id', 'price', 'volume', 'funds', 'time', 'trend']
-      ).to_csv(self.get_file_name(ticker), sep=',')
+      ).to_csv(fileName + '.tmp', sep=',')
+      os.replace(fileName + '.tmp', fileName)
     # a brief feedback message
     print('%d orders of %s were written to the file'%(len(rates),ticker))
 
-  def update_list(self):
+  def select_markets(self):
     """
-    Void helper method that check all tickers on the server and collect all
-    coins those are pair to the UAH.
+    Helper method that check all tickers on the server and returns markets
+    those are quoted in one of the quote currencies, are not denied and have
+    enough volume during the last 24 hours. Allowed markets are always
+    returned if present on the server.
+
+    Returns:
+      list: names of the markets, empty if the request failed
     """
     tickers = self.request('tickers')
-    self.rates = {}
-    self.newData = {}
+    if not isinstance(tickers, dict):
+      return []
+    markets = []
     for ticker in list(tickers):
-      if (ticker[-3:] == 'uah') and (not ticker == 'remuah'):
-        self.rates[ticker] = {}
-        self.newData[ticker] = False
+      if ticker in self.allow:
+        markets.append(ticker)
+      elif (ticker in self.deny) or \
+           (not any(ticker.endswith(quote) for quote in self.quotes)):
+        continue
+      else:
+        # malformed entries, e.g. of an error response, are skipped
+        try:
+          volume = float(tickers[ticker]['ticker']['vol'])
+        except (KeyError, TypeError, ValueError):
+          continue
+        if volume >= self.min_volume:
+          markets.append(ticker)
+    return markets
+
+  def update_list(self):
+    """
+    Helper method that sets the markets of interest: the markets given to the
+    constructor or all selected on the server. Buffers of the markets those
+    are still of interest are kept.
+
+    Returns:
+      list: names of the added markets
+    """
+    markets = self.select_markets() if self.markets is None else self.markets
+    if (not markets) and (self.markets is None):
+      # a failed selection does not drop the collected markets
+      return []
+    added = [ticker for ticker in markets if ticker not in self.rates]
+    for ticker in list(self.rates):
+      if ticker not in markets:
+        # the last collected trades are not lost
+        if self.newData[ticker]:
+          self.write_rates(ticker)
+        del self.rates[ticker]
+        del self.newData[ticker]
+        print('%s was removed from the list' % ticker)
+    for ticker in added:
+      self.rates[ticker] = {}
+      self.newData[ticker] = False
+    return added
+
+  def add_deals(self, key, content):
+    """
+    Helper method that adds unknown deals of the market and passes them to
+    the callbacks.
+
+    Args:
+      key (str): the market name
+      content (list): deals as returned by get_trades_history()
+
+    Returns:
+      int: amount of added deals
+    """
+    added = {}
+    pending = self.pending.setdefault(key, [])
+    # for each order in the order book
+    for deal in content:
+      ID = deal['id']
+      # if we do not have info about the order
+      if not ID in self.rates[key]:
+        # new data in the dictionary
+        self.newData[key] = True
+        pending.append(ID)
+        self.rates[key][ID] = added[ID] = {
+          'price':float(deal['price']),
+          'volume':float(deal['volume']),
+          'funds':float(deal['funds']),
+          'time':deltatime(deal['created_at']),
+          'trend':deal['trend']
+        }
+    if added:
+      for callback in self.callbacks:
+        callback(key, added)
+    return len(added)
+
+  def add_callback(self, callback):
+    """
+    Void method that subscribes a function to new deals. It is called as
+    callback(market, deals) where deals is a dictionary ID -> deal in the same
+    format as self.rates[market]. replay.Replay feeds the same interface.
+
+    Args:
+      callback (function): subscriber
+    """
+    self.callbacks.append(callback)
 
   def update_rates(self):
     """
@@ -373,25 +555,355 @@ class Coins:
     for key in list(self.rates):
       # requests the order book
       content = self.get_trades_history(key)
-      # for each order in the order book
-      for deal in content:
-        ID = deal['id']
-        # if we do not have info about the order
-        if not ID in list(self.rates[key]):
-          # new data in the dictionary
-          self.newData[key] = True
-          self.rates[key][ID] = {
-            'price':float(deal['price']),
-            'volume':float(deal['volume']),
-            'funds':float(deal['funds']),
-            'time':deltatime(deal['created_at']),
-            'trend':deal['trend']
+      if isinstance(content, list):
+        self.fetched[key] = time.time()
+        self.add_deals(key, content)
+
+  def store_pending(self):
+    """
+    Void helper method that writes trades added since the previous call to the
+    storage in a single transaction.
+    """
+    if self.storage is None:
+      self.pending = {}
+      return
+    trades = {}
+    for key, IDs in self.pending.items():
+      if key in self.rates:
+        trades[key] = [
+          (ID, self.rates[key][ID]['price'], self.rates[key][ID]['volume'],
+           self.rates[key][ID]['funds'], self.rates[key][ID]['time'],
+           self.rates[key][ID]['trend'])
+          for ID in IDs if ID in self.rates[key]
+        ]
+    self.pending = {}
+    print('%d trades were stored' % self.storage.write(trades))
+
+  def write_checkpoint(self):
+    """
+    Void helper method that atomically stores trades of all markets to the
+    checkpoint file. The last trade ID of a market is its cursor.
+    """
+    arrays = {}
+    for key in list(self.rates):
+      arrays[key] = np.array([
+        (ID, deal['price'], deal['volume'], deal['funds'], deal['time'],
+         deal['trend'])
+        for ID, deal in self.rates[key].items()
+      ], dtype=TRADE_DTYPE)
+    # np.savez adds the extension if it is absent
+    temporary = self.checkpoint[:-4] + '.tmp.npz'
+    np.savez(temporary, **arrays)
+    os.replace(temporary, self.checkpoint)
+
+  def read_checkpoint(self):
+    """
+    Helper method that restores trades from the checkpoint file.
+
+    Returns:
+      list: names of the restored markets
+    """
+    if not os.path.isfile(self.checkpoint):
+      return []
+    restored = []
+    with np.load(self.checkpoint) as arrays:
+      for key in arrays.files:
+        if key in self.rates:
+          array = arrays[key]
+          self.rates[key] = {
+            int(row['id']): {
+              'price': float(row['price']),
+              'volume': float(row['volume']),
+              'funds': float(row['funds']),
+              'time': int(row['time']),
+              'trend': str(row['trend']),
+            } for row in array
           }
+          restored.append(key)
+    print('%d markets were restored from the %s' % (len(restored), self.checkpoint))
+    return restored
 
-  def __init__(self):
+  def backfill(self, key, pages=100):
+    """
+    Helper method that requests all trades after the last known one.
+
+    Args:
+      key (str): the market name
+      pages (int): maximum amount of requests
+
+    Returns:
+      int: amount of added trades
+    """
+    added = 0
+    for page in range(pages):
+      if len(self.rates[key]) == 0:
+        break
+      content = self.get_trades_history(key, since=max(self.rates[key]))
+      if not isinstance(content, list):
+        break
+      self.fetched[key] = time.time()
+      count = self.add_deals(key, content)
+      added += count
+      # a page without new trades means the server ignores 'from'
+      if (len(content) < TRADES_LIMIT) or (count == 0):
+        break
+    return added
+
+  def __init__(self, clock=None, markets=None, quotes=('uah',), allow=(),
+               deny=('remuah',), min_volume=0, checkpoint='checkpoint.npz',
+               storage=None, retention=None, archive=None):
+    """
+    Args:
+      clock (object): optional source of time with the time() method, e.g.
+        kunaio.ServerClock
+      markets (list): markets to collect, selected on the server if None. An
+        empty list makes an instance only for select_markets(): nothing is
+        collected and the checkpoint is neither read nor written
+      quotes (tuple): quote currencies of selected markets
+      allow (tuple): markets those are selected regardless other conditions
+      deny (tuple): markets those are never selected
+      min_volume (float): minimum volume during the last 24 hours of selected
+        markets in the base currency
+      checkpoint (str): path to the checkpoint file (.npz)
+      storage (object): optional storage of trades with the write() method,
+        e.g. storage.SQLiteStorage
+      retention (storage.Retention): tiers of bars for the reduced trades
+      archive (storage.SegmentArchive): optional archive of the reduced trades
+    """
+    self.clock = clock
+    self.markets = markets
+    self.quotes = quotes
+    self.allow = allow
+    self.deny = deny
+    self.min_volume = min_volume
+    self.checkpoint = checkpoint
+    self.storage = storage
+    self.retention = retention or Retention()
+    self.archive = archive
+    # subscribers to new deals, see add_callback()
+    self.callbacks = []
+    # IDs of trades those are not in the storage yet
+    self.pending = {}
+    # time of the last successful fetch of each market
+    self.fetched = {}
+    self.rates = {}
+    self.newData = {}
+    if self.markets == []:
+      return
     self.update_list()
-    self.read_rates()
+    # warm restart: the checkpoint and the gap after it, files for the rest
+    restored = self.read_checkpoint()
+    self.read_rates([key for key in list(self.rates) if key not in restored])
+    for key in restored:
+      print('%d trades of %s were backfilled' % (self.backfill(key), key))
     self.update_rates()
+    self.store_pending()
+    self.write_checkpoint()
+
+def collect(markets, status, checkpoint, database=None, archive=None,
+            publish=None, stop=None):
+  """
+  Entry point of a worker process that collects a fixed shard of markets.
+
+  Args:
+    markets (list): names of the markets of the shard
+    status (multiprocessing.Queue): queue for the health status
+    checkpoint (str): path to the checkpoint file of the shard
+    database (str): optional path to the SQLite storage
+    archive (str): optional directory of the archive segments
+    publish (str): optional path to the socket to publish new trades
+    stop (multiprocessing.Event): optional, set to write the collected trades
+      and exit
+  """
+  storage = SQLiteStorage(database) if database else None
+  archive = SegmentArchive(archive) if archive else None
+  coins = Coins(markets=markets, checkpoint=checkpoint, storage=storage,
+                archive=archive)
+  if publish:
+    coins.add_callback(Publisher(publish))
+  coins.idle(report=status.put, stop=stop)
+
+class Supervisor:
+  """
+  Splits the markets across worker processes, restarts crashed workers and
+  merges their health status. The markets are selected on the server again
+  every `refresh` seconds and the shards follow the selection.
+  """
+
+  def __init__(self, workers=None, database=None, archive=None, publish=None,
+               refresh=3600, grace=120, **selection):
+    """
+    Args:
+      workers (int): amount of worker processes, CPU count by default
+      database (str): optional path to the SQLite storage shared by workers
+      archive (str): optional directory of the archive segments
+      publish (str): optional path prefix of the sockets to publish new
+        trades, the number of the shard is appended
+      refresh (float): seconds between selections of the markets
+      grace (float): seconds for a stopped worker to write its trades before
+        it is terminated
+      selection: quotes, allow, deny and min_volume arguments of Coins
+    """
+    self.workers = workers or os.cpu_count()
+    self.database = database
+    self.archive = archive
+    self.publish = publish
+    self.refresh = refresh
+    self.grace = grace
+    self.selection = selection
+    self.status = multiprocessing.Queue()
+    self.health = {}
+    self.restarts = {}
+    self.processes = {}
+    # events those ask the workers to write their trades and exit
+    self.stops = {}
+
+  def start(self, shard):
+    """
+    Void helper method that starts the worker of a shard.
+
+    Args:
+      shard (int): number of the shard
+    """
+    self.stops[shard] = multiprocessing.Event()
+    self.processes[shard] = multiprocessing.Process(
+      target=collect,
+      args=(self.shards[shard], self.status, 'checkpoint.%d.npz' % shard,
+            self.database, self.archive,
+            '%s.%d' % (self.publish, shard) if self.publish else None,
+            self.stops[shard]),
+      daemon=True
+    )
+    self.processes[shard].start()
+
+  def merged_health(self):
+    """
+    Health status of all workers.
+
+    Returns:
+      dict: 'workers' alive, 'restarts' in total and the maximum 'lag' over
+        all markets.
+    """
+    lags = [lag for status in self.health.values()
+            for lag in status['lag'].values()]
+    return {
+      'workers': sum(p.is_alive() for p in self.processes.values()),
+      'restarts': sum(self.restarts.values()),
+      'lag': max(lags) if lags else None,
+    }
 
-coins = Coins()
-coins.idle()
\ No newline at end of file
+  def reshard(self, markets):
+    """
+    Moves the shards to a new selection of markets: unselected markets leave
+    their shards and new markets join the smallest shards. Workers of changed
+    shards are asked to write their trades and exit, and are started again
+    from their checkpoints.
+
+    Args:
+      markets (list): names of the selected markets
+
+    Returns:
+      int: amount of restarted workers
+    """
+    changed = set()
+    for shard, names in enumerate(self.shards):
+      kept = [name for name in names if name in markets]
+      if len(kept) < len(names):
+        self.shards[shard] = kept
+        changed.add(shard)
+    known = {name for names in self.shards for name in names}
+    for name in markets:
+      if name not in known:
+        shard = min(range(len(self.shards)), key=lambda i: len(self.shards[i]))
+        self.shards[shard].append(name)
+        changed.add(shard)
+    for shard in changed:
+      process = self.processes[shard]
+      self.stops[shard].set()
+      process.join(self.grace)
+      if process.is_alive():
+        process.terminate()
+        process.join()
+      self.health.pop(process.pid, None)
+      self.start(shard)
+    return len(changed)
+
+  def run(self, period=60):
+    """
+    Void method that starts the workers and supervises them forever.
+
+    Args:
+      period (float): seconds between health reports
+    """
+    selector = Coins(markets=[], **self.selection)
+    markets = selector.select_markets()
+    self.workers = min(self.workers, len(markets)) or 1
+    self.shards = [markets[i::self.workers] for i in range(self.workers)]
+    for shard in range(self.workers):
+      self.restarts[shard] = 0
+      self.start(shard)
+
+    reported = selected = time.time()
+    while True:
+      if time.time() - selected > self.refresh:
+        selected = time.time()
+        markets = selector.select_markets()
+        # a failed request gives no markets, the shards are kept then
+        if markets:
+          restarted = self.reshard(markets)
+          if restarted:
+            print('%s | Markets were selected again, %d workers restarted' % (
+              time.strftime("%H:%M:%S", time.localtime()), restarted))
+      # merges statuses by the worker process
+      while not self.status.empty():
+        status = self.status.get()
+        self.health[status['pid']] = status
+      for shard, process in list(self.processes.items()):
+        if not process.is_alive():
+          print('%s | Worker of %d markets exited with code %s, restarting' % (
+            time.strftime("%H:%M:%S", time.localtime()),
+            len(self.shards[shard]), process.exitcode))
+          self.health.pop(process.pid, None)
+          self.restarts[shard] += 1
+          self.start(shard)
+      if time.time() - reported > period:
+        reported = time.time()
+        print('%s | Health: %s' % (
+          time.strftime("%H:%M:%S", time.localtime()), self.merged_health()))
+      time.sleep(1)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Collects trades from kuna.io')
+  parser.add_argument('--workers', type=int, default=0,
+    help='amount of worker processes, 0 to collect in this process')
+  parser.add_argument('--quotes', nargs='*', default=['uah'],
+    help='quote currencies of collected markets')
+  parser.add_argument('--allow', nargs='*', default=[],
+    help='markets those are always collected')
+  parser.add_argument('--deny', nargs='*', default=['remuah'],
+    help='markets those are never collected')
+  parser.add_argument('--min-volume', type=float, default=0,
+    help='minimum volume during the last 24 hours in the base currency')
+  parser.add_argument('--sqlite', default=None,
+    help='path to the SQLite storage of trades')
+  parser.add_argument('--archive', default=None,
+    help='directory of compressed segments of trades older than 3 weeks')
+  parser.add_argument('--publish', default=None,
+    help='path to the Unix socket to publish new trades')
+  args = parser.parse_args()
+  selection = {
+    'quotes': tuple(args.quotes),
+    'allow': tuple(args.allow),
+    'deny': tuple(args.deny),
+    'min_volume': args.min_volume,
+  }
+  if args.workers > 0:
+    Supervisor(args.workers, database=args.sqlite, archive=args.archive,
+               publish=args.publish, **selection).run()
+  else:
+    storage = SQLiteStorage(args.sqlite) if args.sqlite else None
+    archive = SegmentArchive(args.archive) if args.archive else None
+    coins = Coins(storage=storage, archive=archive, **selection)
+    if args.publish:
+      coins.add_callback(Publisher(args.publish))
+    coins.idle()
\ No newline at end of file
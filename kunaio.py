@@ -1,3 +1,6 @@
+import concurrent.futures
+import threading
+import os
 import requests
 import hashlib
 import random
@@ -5,7 +8,374 @@ import time
 import json
 import hmac
 
+import kunamodels
+from kunamodels import Order
+
+# the fastest available JSON decoder
+try:
+  import orjson
+  _loads = orjson.loads
+except ImportError:
+  try:
+    import ujson
+    _loads = ujson.loads
+  except ImportError:
+    _loads = json.loads
+
 DOMAIN = "https://api.kuna.io/v3/"
+_EMPTY_BODY_ = json.dumps({})
+"""str: serialized empty body of a private request"""
+_SIGNERS_ = {}
+"""dict: (public, private) -> Signer, one signer per key pair"""
+_SIGNERS_LOCK_ = threading.Lock()
+"""threading.Lock: guards _SIGNERS_"""
+RATE_LIMIT = 10
+"""int: default maximum amount of private requests per second of a key pair"""
+CACHE_DIR = ".kunaio"
+"""str: directory with warm-start files of the reference caches"""
+CLOCK = None
+"""ServerClock: source of nonces and timestamps, local time if None"""
+
+def now():
+  """
+  Returns current time in seconds by the CLOCK or by the local clock.
+  """
+
+  return CLOCK.time() if CLOCK else time.time()
+
+class ServerClock:
+  """
+  Tracks offset and drift of the server clock relatively to the local one, so
+  corrected time is available without a request. The server time is sampled
+  in a background thread, each sample is compensated by half of the round
+  trip time, and the offset is fitted by a line over the samples with the
+  shortest round trips.
+
+  Optional arguments:
+    interval (float) : [s] time between samples
+    samples (int) : amount of kept samples
+    fetch (function) : returns the server time in seconds, by default
+                       get_timestamp() of the API v3
+  """
+
+  def __init__(self, interval=60, samples=16, fetch=None):
+
+    self.interval = interval
+    self.samples = []
+    self.size = samples
+    self.fetch = fetch or self._fetch
+    self.offset = 0.
+    self.drift = 0.
+    self._reference = time.time()
+    self._lock = threading.Lock()
+    self._thread = None
+    self._stop = threading.Event()
+
+  @staticmethod
+  def _fetch():
+
+    response = _request("timestamp", attempts=1)
+    if "timestamp_miliseconds" in response:
+      return response["timestamp_miliseconds"] / 1000
+    return float(response["timestamp"])
+
+  def sample(self):
+    """
+    Requests the server time once and updates the estimation.
+    """
+
+    t0 = time.time()
+    server = self.fetch()
+    t1 = time.time()
+    # the server time is expected in the middle of the round trip
+    middle = 0.5 * (t0 + t1)
+
+    with self._lock:
+      self.samples.append((middle, server - middle, t1 - t0))
+      self.samples = self.samples[-self.size:]
+      # half of the samples with the shortest round trips
+      best = sorted(self.samples, key=lambda x: x[2])[:max(2, len(self.samples) // 2)]
+      if len(best) < 2:
+        self._reference, self.offset, self.drift = middle, server - middle, 0.
+        return
+      n = len(best)
+      mt = sum(x[0] for x in best) / n
+      mo = sum(x[1] for x in best) / n
+      var = sum((x[0] - mt) ** 2 for x in best)
+      self.drift = sum((x[0] - mt) * (x[1] - mo) for x in best) / var if var else 0.
+      self._reference, self.offset = mt, mo
+
+  def time(self):
+    """
+    Returns corrected current time in seconds.
+    """
+
+    local = time.time()
+    return local + self.offset + self.drift * (local - self._reference)
+
+  def start(self):
+    """
+    Samples the server time in a background thread and sets the clock as the
+    CLOCK of the module.
+    """
+
+    global CLOCK
+
+    def loop():
+
+      while not self._stop.wait(self.interval):
+        try:
+          self.sample()
+        except Exception as e:
+          print(f"Server time sampling failed with error: {e}")
+
+    self._stop.clear()
+    self.sample()
+    self._thread = threading.Thread(target=loop, daemon=True)
+    self._thread.start()
+    CLOCK = self
+
+  def stop(self):
+    """
+    Stops the background sampling. The module falls back to the local clock.
+    """
+
+    global CLOCK
+
+    self._stop.set()
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+    if CLOCK is self:
+      CLOCK = None
+
+class RateLimiter:
+  """
+  Token bucket shared by threads: no more than `rate` calls per second on
+  average and no more than `rate` calls in a burst.
+
+  Arguments:
+    rate (float) : calls per second
+  """
+
+  def __init__(self, rate):
+
+    self.rate = rate
+    self._tokens = rate
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
+
+  def wait(self):
+    """
+    Blocks until a call is allowed.
+    """
+
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        delay = (1 - self._tokens) / self.rate
+      time.sleep(delay)
+
+class Signer:
+  """
+  Signs private requests with a key pair. The HMAC state is keyed once and
+  copied for each request, nonces are strictly increasing across threads.
+  All private requests of the key pair share the rate limiter.
+
+  Arguments:
+    keys (dict): {
+      "private" : "",
+      "public" : ""
+    }
+  """
+
+  def __init__(self, keys):
+
+    self.public = keys["public"]
+    self._hmac = hmac.new(keys["private"].encode("ascii"), digestmod=hashlib.sha384)
+    self._nonce = 0
+    self._lock = threading.Lock()
+    self.limiter = RateLimiter(RATE_LIMIT)
+
+  def nonce(self):
+    """
+    Returns current time in ms by now(), or the previous nonce plus one if the
+    time is not ahead of it.
+    """
+
+    with self._lock:
+      self._nonce = max(self._nonce + 1, int(now() * 1000))
+      return self._nonce
+
+  def headers(self, path, jbody):
+    """
+    Authentication headers of a private request.
+
+    Arguments:
+      path (str) : API path
+      jbody (str) : serialized body of the request
+
+    Returns:
+      (dict): kun-nonce, kun-apikey and kun-signature headers
+    """
+
+    nonce = str(self.nonce())
+    signature = self._hmac.copy()
+    signature.update(f"{DOMAIN[-4:]}{path}{nonce}{jbody}".encode("ascii"))
+    return {
+      "kun-nonce": nonce,
+      "kun-apikey": self.public,
+      "kun-signature": signature.hexdigest(),
+    }
+
+def get_signer(keys):
+  """
+  Returns the signer bound to the key pair.
+
+  Arguments:
+    keys (dict): {
+      "private" : "",
+      "public" : ""
+    }
+  or
+    Signer: returned as is
+
+  Returns:
+    Signer
+  """
+
+  if isinstance(keys, Signer):
+    return keys
+  pair = (keys["public"], keys["private"])
+  with _SIGNERS_LOCK_:
+    if pair not in _SIGNERS_:
+      _SIGNERS_[pair] = Signer(keys)
+    return _SIGNERS_[pair]
+
+class ReferenceCache:
+  """
+  TTL cache of a public endpoint with rarely changing data. The data is kept
+  in memory and in a warm-start file, so a new process does not request it
+  while the file is fresh. An expired entry is revalidated: it is requested
+  again and its digest is compared with the cached one.
+
+  Arguments:
+    path (str) : API path
+
+  Optional arguments:
+    ttl (float) : [s] time to live of the data
+    directory (str) : directory of the warm-start file, None to keep the data
+                      in memory only
+  """
+
+  def __init__(self, path, ttl=3600, directory=CACHE_DIR):
+
+    self.path = path
+    self.ttl = ttl
+    self.file = os.path.join(directory, f"{path}.json") if directory else None
+    self.data = None
+    self.digest = None
+    self.time = None
+    self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "changed": 0}
+    self._lock = threading.Lock()
+
+  @property
+  def age(self):
+    """
+    (float): [s] time since the data was requested or revalidated, None if
+             there is no data
+    """
+
+    return None if self.time is None else time.time() - self.time
+
+  def _read(self):
+    """
+    Loads the warm-start file if it is present and the memory is empty.
+    """
+
+    if (self.data is None) and self.file and os.path.isfile(self.file):
+      try:
+        with open(self.file, "r") as f:
+          entry = json.load(f)
+        self.data, self.digest, self.time = \
+          entry["data"], entry["digest"], entry["time"]
+      except (ValueError, KeyError, OSError):
+        pass
+
+  def _write(self):
+    """
+    Stores the data to the warm-start file atomically.
+    """
+
+    if self.file:
+      # processes and threads refreshing at once write their own files
+      temporary = f"{self.file}.{os.getpid()}.{threading.get_ident()}.tmp"
+      try:
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(temporary, "w") as f:
+          json.dump({"data": self.data, "digest": self.digest, "time": self.time}, f)
+        os.replace(temporary, self.file)
+      except OSError:
+        # the data is still cached in memory
+        if os.path.exists(temporary):
+          os.remove(temporary)
+
+  def get(self):
+    """
+    Returns the cached data, requests it if it is absent or expired.
+    """
+
+    with self._lock:
+
+      self._read()
+      if (self.data is not None) and (self.age < self.ttl):
+        self.stats["hits"] += 1
+        return self.data
+
+      self.stats["misses"] += 1
+      data = _request(self.path)
+      # error responses are not cached, the stale data is better
+      if isinstance(data, dict) and data.get("messages"):
+        return self.data if self.data is not None else data
+      digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+      if digest == self.digest:
+        self.stats["revalidated"] += 1
+      else:
+        self.stats["changed"] += 1
+        self.data, self.digest = data, digest
+      self.time = time.time()
+      self._write()
+      return self.data
+
+  def invalidate(self):
+    """
+    Drops the data from the memory and the warm-start file.
+    """
+
+    with self._lock:
+      self.data, self.digest, self.time = None, None, None
+      if self.file and os.path.isfile(self.file):
+        os.remove(self.file)
+
+CURRENCIES = ReferenceCache("currencies")
+"""ReferenceCache: cache of get_currencies_list()"""
+MARKETS = ReferenceCache("markets")
+"""ReferenceCache: cache of get_markets_list()"""
+FEES = ReferenceCache("fees")
+"""ReferenceCache: cache of get_fees()"""
+
+def _typed(response, parser):
+  """
+  Parses a list response by the parser. Other responses (errors) are returned
+  as is.
+  """
+
+  return parser(response) if isinstance(response, list) else response
 
 def get_server_time():
   """
@@ -33,10 +403,13 @@ def get_timestamp():
 
   return get_server_time()
 
-def get_currencies_list():
+def get_currencies_list(cached=True):
   """
   Get list of all available currencies on the market.
 
+  Optional arguments:
+    cached (bool) : returns the data of CURRENCIES cache if True
+
   Returns:
     (list): [
       {
@@ -65,12 +438,15 @@ def get_currencies_list():
     ]
   """
 
-  return _request("currencies")
+  return CURRENCIES.get() if cached else _request("currencies")
 
-def get_markets_list():
+def get_markets_list(cached=True):
   """
   Get list of all available currency exchange markets.
 
+  Optional arguments:
+    cached (bool) : returns the data of MARKETS cache if True
+
   Returns:
     (list): [
       {
@@ -87,9 +463,9 @@ def get_markets_list():
     ]
   """
 
-  return _request("markets")
+  return MARKETS.get() if cached else _request("markets")
 
-def get_recent_market_data(ticker="ALL"):
+def get_recent_market_data(ticker="ALL", typed=False):
   """
   Get recent market data.
 
@@ -99,6 +475,7 @@ def get_recent_market_data(ticker="ALL"):
     list["str"]: the names of currency pairs.
   or
     default behavior: all available pairs on the market.
+    typed (bool): returns numpy array of kunamodels.TICKER_DTYPE records
 
   Returns:
     (list): [
@@ -128,15 +505,19 @@ def get_recent_market_data(ticker="ALL"):
   else:
     args = {"symbols": "ALL"}
 
-  return _request("tickers", args=args)
+  response = _request("tickers", args=args)
+  return _typed(response, kunamodels.tickers_array) if typed else response
 
-def get_order_book(ticker):
+def get_order_book(ticker, typed=False):
   """
   Get order book.
 
   Args:
     ticker (str): the market name.
 
+  Optional arguments:
+    typed (bool): returns numpy array of kunamodels.BOOK_DTYPE records
+
   Returns:
     (list): [
       (list): [
@@ -147,12 +528,19 @@ def get_order_book(ticker):
     ]
   """
 
+  if typed:
+    # the book is decoded straight from the bytes into the array
+    raw = _request(f"book/{ticker}", raw=True)
+    return kunamodels.book_array(raw) if raw.startswith(b"[") else _loads(raw)
   return _request(f"book/{ticker}")
 
-def get_fees():
+def get_fees(cached=True):
   """
   List of active methods to put in/out currencies, and commissions.
 
+  Optional arguments:
+    cached (bool) : returns the data of FEES cache if True
+
   Returns:
     (list): [
       (dict) {
@@ -171,7 +559,7 @@ def get_fees():
     ]
   """
 
-  return _request("fees")
+  return FEES.get() if cached else _request("fees")
 
 def get_user_info(keys):
   """
@@ -211,7 +599,7 @@ def get_user_info(keys):
 
   return _request("auth/me", keys=keys)
 
-def get_user_balance(keys):
+def get_user_balance(keys, typed=False):
   """
   Return balances and accessible funds on all available user"s wallets.
 
@@ -221,6 +609,9 @@ def get_user_balance(keys):
       "public" : ""
     }
 
+  Optional arguments:
+    typed (bool): returns a list of kunamodels.Balance
+
   Returns:
     (list) [
       (list) [
@@ -233,7 +624,10 @@ def get_user_balance(keys):
     ]
   """
 
-  return _request("auth/r/wallets", keys=keys)
+  response = _request("auth/r/wallets", keys=keys)
+  if typed:
+    return _typed(response, lambda rows: [kunamodels.Balance.from_list(r) for r in rows])
+  return response
 
 def request_email_user_history(market, keys, date_from=None, date_to=None):
   """
@@ -259,7 +653,7 @@ def request_email_user_history(market, keys, date_from=None, date_to=None):
 
   _request("auth/history/trades", body=body, keys=keys)
 
-def get_user_active(keys, market=None):
+def get_user_active(keys, market=None, typed=False):
   """
   List of the user"s active orders.
 
@@ -271,6 +665,7 @@ def get_user_active(keys, market=None):
 
   Optional arguments:
     market (str) : name of a market
+    typed (bool) : returns a list of kunamodels.Order
 
   Returns:
     (list) [
@@ -305,9 +700,13 @@ def get_user_active(keys, market=None):
   """
 
   S = f"auth/r/orders/{market}" if market else "auth/r/orders"
-  return _request(S, keys=keys)
+  response = _request(S, keys=keys)
+  if typed:
+    return _typed(response, lambda rows: [Order.from_list(r) for r in rows])
+  return response
 
-def get_user_executed(keys, market=None, start=None, end=None, limit=None, sort=None):
+def get_user_executed(keys, market=None, start=None, end=None, limit=None, sort=None,
+                      typed=False):
   """
   List of the user"s executed orders.
 
@@ -323,6 +722,7 @@ def get_user_executed(keys, market=None, start=None, end=None, limit=None, sort=
     end (int) : date to in ms. By default now,
     limit (int) : amount of orders. By default 25. Max 100,
     sort (int) : 1 or -1. Sort order. By default in descending order,
+    typed (bool) : returns a list of kunamodels.Order
 
   Returns:
     (list) [
@@ -366,12 +766,96 @@ def get_user_executed(keys, market=None, start=None, end=None, limit=None, sort=
   if sort:
     body["sort"] = sort
   path = f"auth/r/orders/{market + '/' if market else ''}hist"
-  if start:
-    body["start"] = start
 
-  return _request(path, body=body, keys=keys)
+  response = _request(path, body=body, keys=keys)
+  if typed:
+    return _typed(response, lambda rows: [Order.from_list(r) for r in rows])
+  return response
 
-def get_order_details(market, order_id, keys):
+class ExecutedHistory:
+  """
+  Iterates over all user's executed orders in a date range in ascending order
+  of the update time. Pages are requested by get_user_executed() and the next
+  page is requested while the current one is processed, so no more than two
+  pages are kept in memory.
+
+  Arguments:
+    keys (dict): {
+      "private" : "",
+      "public" : ""
+    }
+
+  Optional arguments:
+    market (str) : name of a market,
+    start (int) : date from in ms. By default 2 weeks ago,
+    end (int) : date to in ms. By default now,
+    limit (int) : amount of orders per page. Max 100,
+    checkpoint (dict) : self.checkpoint of an interrupted iteration to resume
+                        from
+    attempts (int) : maximum amount of requests of a page answered with an
+                     error, RuntimeError is raised after the last one
+
+  Yields:
+    (list): executed order, see get_user_executed()
+  """
+
+  def __init__(self, keys, market=None, start=None, end=None, limit=100,
+               checkpoint=None, attempts=5):
+
+    self.signer = get_signer(keys)
+    self.market = market
+    self.end = end
+    self.limit = limit
+    self.attempts = attempts
+    # time of the last yielded order and IDs of yielded orders with this time
+    self.checkpoint = checkpoint or {"start": start, "seen": []}
+
+  def _page(self, start):
+
+    for attempt in range(self.attempts):
+      page = get_user_executed(self.signer, self.market, start=start,
+                               end=self.end, limit=self.limit, sort=1)
+      if isinstance(page, list):
+        return page
+      # an error is not the end of the history, e.g. the rate limit
+      time.sleep(2**attempt)
+    raise RuntimeError(f"Executed orders from {start} failed: {page}")
+
+  def __iter__(self):
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+
+      start = self.checkpoint["start"]
+      future = pool.submit(self._page, start)
+      while future is not None:
+
+        page = future.result()
+        future = None
+        if len(page) >= self.limit:
+          # pages overlap at the last time to not miss orders with equal time,
+          # a page full of orders with the same time is skipped over
+          last = max(row[5] for row in page)
+          if (start is None) or (last > start):
+            start = last
+            future = pool.submit(self._page, start)
+          elif last == start:
+            start = last + 1
+            future = pool.submit(self._page, start)
+          # otherwise the page did not move past start, nothing new is left
+
+        for row in page:
+          if (self.checkpoint["start"] is not None) and \
+             (row[5] < self.checkpoint["start"]):
+            continue
+          if (row[5] == self.checkpoint["start"]) and \
+             (row[0] in self.checkpoint["seen"]):
+            continue
+          if row[5] != self.checkpoint["start"]:
+            self.checkpoint = {"start": row[5], "seen": []}
+          self.checkpoint["seen"].append(row[0])
+          yield row
+
+def get_order_details(market, order_id, keys, typed=False):
   """
   List of dealings for a certain order
 
@@ -383,6 +867,9 @@ def get_order_details(market, order_id, keys):
       "public" : ""
     }
 
+  Optional arguments:
+    typed (bool) : returns a list of kunamodels.Deal
+
 
   Returns:
     (list)  [
@@ -403,7 +890,10 @@ def get_order_details(market, order_id, keys):
   """
 
   S = f"auth/r/order/{market}:{order_id}/trades"
-  return _request(S, keys=keys)
+  response = _request(S, keys=keys)
+  if typed:
+    return _typed(response, lambda rows: [kunamodels.Deal.from_list(r) for r in rows])
+  return response
 
 def set_order(market, order_type, amount, price, keys, stop_price=None):
   """
@@ -461,16 +951,23 @@ def set_order(market, order_type, amount, price, keys, stop_price=None):
       [31]  (NoneType)  not in use,
     ]
   """
-  body = {
+  body = _order_body(market, order_type, amount, price, stop_price)
+
+  return _request("auth/w/order/submit", body=body, keys=keys)
+
+def _order_body(market, order_type, amount, price, stop_price=None):
+  """
+  Body of the order submit request. See set_order() for the arguments.
+  """
+
+  return {
     "symbol": market,
     "type": order_type,
     "amount": amount,
     "price": price,
-    "stop_price": price,
+    "stop_price": stop_price if stop_price else price,
   }
 
-  return _request("auth/w/order/submit", body=body, keys=keys)
-
 def cancel_order(order_id, keys):
   """
   Cancel the order
@@ -506,6 +1003,251 @@ def cancel_order(order_id, keys):
 
   return _request("order/cancel", body=body, keys=keys)
 
+def submit_batch(keys, orders=(), cancels=(), workers=8, rate=None):
+  """
+  Cancels and creates orders concurrently under the rate limit. All cancels
+  are finished before the first order is placed, so stale quotes are not left
+  on the book together with the new ones. Failed requests are not repeated.
+
+  Arguments:
+    keys (dict): {
+      "private" : "",
+      "public" : ""
+    }
+
+  Optional arguments:
+    orders (list) : [
+      (dict) {
+        "market"      (str)   : market name,
+        "order_type"  (str)   : see set_order(),
+        "amount"      (float) : positive if BUY order, and negative for SELL,
+        "price"       (float) : price of 1 ask currency in a quoted currency,
+        "stop_price"  (float) : optional, see set_order()
+      }
+    ]
+    cancels (list) : [ (int) ID of an order ]
+    workers (int) : amount of simultaneous requests
+    rate (float) : optional stricter limit of requests per second of this
+                   batch, the shared limit of the key pair applies anyway
+
+  Returns:
+    (dict): {
+      "cancels" (list) : results in the order of cancels,
+      "orders"  (list) : results in the order of orders [
+        (dict) {
+          "intent"  : the order dict or the order ID,
+          "result"  : response as for set_order() or cancel_order(),
+                      None on error,
+          "error"   (str)   : error message of the request or of the API,
+                      None on success,
+          "latency" (float) : [s] duration of the request
+        }
+      ]
+    }
+  """
+
+  signer = get_signer(keys)
+  limiter = RateLimiter(rate) if rate else None
+
+  def execute(intent, path, body):
+
+    if limiter:
+      limiter.wait()
+    start = time.perf_counter()
+    try:
+      result, error = _request(path, body=body, keys=signer, attempts=1), None
+      # the API answers errors with a dict of messages
+      if isinstance(result, dict) and \
+         (("messages" in result) or ("error" in result)):
+        result, error = None, str(result.get("messages", result.get("error")))
+    except Exception as e:
+      result, error = None, str(e)
+    return {
+      "intent": intent,
+      "result": result,
+      "error": error,
+      "latency": time.perf_counter() - start,
+    }
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+
+    cancelled = list(pool.map(
+      lambda order_id: execute(order_id, "order/cancel", {"order_id": order_id}),
+      cancels
+    ))
+    placed = list(pool.map(
+      lambda order: execute(order, "auth/w/order/submit", _order_body(**order)),
+      orders
+    ))
+
+  return {"cancels": cancelled, "orders": placed}
+
+class OrderCache:
+  """
+  In-process state of the user's orders keyed by order ID. It is updated by
+  the responses of place() and cancel() and reconciled with the server by
+  reconcile(), so state queries do not need network.
+
+  Arguments:
+    keys (dict): {
+      "private" : "",
+      "public" : ""
+    }
+
+  Optional arguments:
+    market (str) : name of a market to follow. All markets by default
+  """
+
+  def __init__(self, keys, market=None):
+
+    self.signer = get_signer(keys)
+    self.market = market
+    self.orders = {}
+    # reconciliation traffic and its outcome
+    self.stats = {"requests": 0, "added": 0, "updated": 0, "closed": 0}
+    self._last = int(now() * 1000)
+    self._lock = threading.Lock()
+    self._thread = None
+    self._stop = threading.Event()
+
+  def _store(self, order):
+    """
+    Puts the order into the cache. Returns True if the order is new or its
+    state is changed.
+    """
+
+    with self._lock:
+      changed = self.orders.get(order.id) != order
+      self.orders[order.id] = order
+      return changed
+
+  def place(self, market, order_type, amount, price, stop_price=None):
+    """
+    Creates an order, see set_order().
+
+    Returns:
+      Order: created order or None if the response is not an order
+    """
+
+    response = set_order(market, order_type, amount, price, self.signer,
+                         stop_price=stop_price)
+    if not isinstance(response, list):
+      return None
+    order = Order.from_list(response)
+    self._store(order)
+    return order
+
+  def cancel(self, order_id):
+    """
+    Cancels the order, see cancel_order().
+
+    Returns:
+      Order: cancelled order or None if the response is not an order
+    """
+
+    response = cancel_order(order_id, self.signer)
+    if not (isinstance(response, dict) and "id" in response):
+      return None
+    order = Order.from_dict(response)
+    self._store(order)
+    return order
+
+  def get(self, order_id):
+    """
+    Returns:
+      Order: cached order or None
+    """
+
+    return self.orders.get(order_id)
+
+  def active(self, market=None):
+    """
+    Returns:
+      (list): cached active orders of the market or of all markets
+    """
+
+    with self._lock:
+      return [o for o in self.orders.values() if o.is_active and
+              ((market is None) or (o.market == market))]
+
+  def reconcile(self):
+    """
+    Compares the cache with the active orders on the server. Orders that are
+    not active anymore are refreshed by one request of the orders executed
+    since the previous reconciliation.
+
+    Returns:
+      (int): amount of added, updated and closed orders
+    """
+
+    moment = int(now() * 1000)
+    active = get_user_active(self.signer, self.market)
+    self.stats["requests"] += 1
+    if not isinstance(active, list):
+      return 0
+
+    changes = 0
+    ids = set()
+    for row in active:
+      order = Order.from_list(row)
+      ids.add(order.id)
+      if order.id not in self.orders:
+        self.stats["added"] += 1
+      elif self.orders[order.id] != order:
+        self.stats["updated"] += 1
+      else:
+        continue
+      self._store(order)
+      changes += 1
+
+    gone = [o.id for o in self.active(self.market) if o.id not in ids]
+    if gone:
+      executed = get_user_executed(self.signer, self.market,
+                                   start=self._last - 1000, limit=100)
+      self.stats["requests"] += 1
+      if isinstance(executed, list):
+        for row in executed:
+          if row[0] in gone:
+            self._store(Order.from_list(row))
+      # orders missed in the history are closed anyway
+      with self._lock:
+        for order_id in gone:
+          if self.orders[order_id].is_active:
+            self.orders[order_id].status = "CLOSED"
+      self.stats["closed"] += len(gone)
+      changes += len(gone)
+
+    self._last = moment
+    return changes
+
+  def start(self, interval=10):
+    """
+    Reconciles the cache in a background thread every `interval` seconds.
+    """
+
+    def loop():
+
+      while not self._stop.wait(interval):
+        try:
+          self.reconcile()
+        except Exception as e:
+          print(f"Order cache reconciliation failed with error: {e}")
+
+    self._stop.clear()
+    self.reconcile()
+    self._thread = threading.Thread(target=loop, daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    """
+    Stops the background reconciliation.
+    """
+
+    self._stop.set()
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+
 def http_test(keys):
   """
   Test HTTP connection to private API
@@ -521,7 +1263,8 @@ def http_test(keys):
 
   return _request("http_test", keys=keys)
 
-def _request(path, args={}, body={}, keys=None, iteration=1):
+def _request(path, args={}, body={}, keys=None, iteration=1, attempts=None,
+             raw=False):
   """
   Fetches the given path in the Kuna API.
 
@@ -535,6 +1278,11 @@ def _request(path, args={}, body={}, keys=None, iteration=1):
       "private" : "",
       "public" : ""
     }
+  or
+    Signer: signer bound to a key pair
+    attempts (int): maximum amount of attempts, the last error is raised.
+                    Unlimited by default.
+    raw (bool): returns the body of the response as bytes without decoding
 
   Returns: serialized server's response
   """
@@ -570,29 +1318,71 @@ def _request(path, args={}, body={}, keys=None, iteration=1):
     if not keys:
 
       # in case of absent arguments it will be OK for the requests
-      return requests.get(DOMAIN+path, data=args, headers=headers).json()
+      response = requests.get(DOMAIN+path, data=args, headers=headers)
+      return response.content if raw else _loads(response.content)
 
     # according to the documentation
     if body:
 
       headers["content-type"] = "application/json"
-    jbody = json.dumps(body)
+      jbody = json.dumps(body)
+    else:
+
+      jbody = _EMPTY_BODY_
 
     # here keys are always present so the method is always private
-    nonce = str(int(time.time() * 1000))
-    headers["kun-nonce"] = nonce
-    headers["kun-apikey"] = keys["public"]
-    headers["kun-signature"] = hmac.new(
-      keys["private"].encode("ascii"),
-      f"{DOMAIN[-4:]}{path}{nonce}{jbody}".encode("ascii"),
-      hashlib.sha384
-    ).hexdigest()
-
-    return requests.post(DOMAIN+path, data=jbody.encode(), headers=headers).json()
+    signer = get_signer(keys)
+    signer.limiter.wait()
+    headers.update(signer.headers(path, jbody))
+
+    response = requests.post(DOMAIN+path, data=jbody.encode(), headers=headers)
+    return response.content if raw else _loads(response.content)
   except Exception as e:
 
+    if attempts and (iteration >= attempts):
+      raise
     dt = int(10*random.random())
     print(f"Failed on the iteration #{iteration} with error: {e}")
     print(f"But we will wait {dt} s and try again.")
     time.sleep(dt)
-    return _request(path=path, args=args, body=body, keys=keys, iteration=iteration+1)
+    return _request(path=path, args=args, body=body, keys=keys,
+                    iteration=iteration+1, attempts=attempts, raw=raw)
+
+def benchmark_decoders(path, repeat=100):
+  """
+  Measures decode time of a recorded response by all available decoders.
+
+  Arguments:
+    path (str) : path to a recorded response, e.g. of the book/{ticker}
+
+  Optional arguments:
+    repeat (int) : amount of repetitions
+
+  Returns:
+    (dict) : decoder name -> average decode time in seconds
+  """
+
+  with open(path, "rb") as f:
+    raw = f.read()
+
+  decoders = [("json", json.loads)]
+  for name in ("orjson", "ujson"):
+    try:
+      decoders.append((name, __import__(name).loads))
+    except ImportError:
+      continue
+  decoders.append(("json + book_array",
+                   lambda raw: kunamodels.book_array(json.loads(raw))))
+  decoders.append(("raw book_array", kunamodels.book_array))
+
+  results = {}
+  for name, decoder in decoders:
+    try:
+      start = time.perf_counter()
+      for i in range(repeat):
+        decoder(raw)
+      results[name] = (time.perf_counter() - start) / repeat
+    except ValueError:
+      # not a book payload
+      continue
+  return results
@@ -0,0 +1,257 @@
+import numpy as np
+from numpy.lib import recfunctions
+
+TICKER_DTYPE = np.dtype([
+  ("ticker", "U16"),
+  ("bid", "f8"),
+  ("bid_volume", "f8"),
+  ("ask", "f8"),
+  ("ask_volume", "f8"),
+  ("change", "f8"),
+  ("change_percent", "f8"),
+  ("last", "f8"),
+  ("volume", "f8"),
+  ("high", "f8"),
+  ("low", "f8"),
+])
+"""numpy.dtype: record of kunaio.get_recent_market_data()"""
+BOOK_DTYPE = np.dtype([
+  ("price", "f8"),
+  ("volume", "f8"),
+  ("count", "i8"),
+])
+"""numpy.dtype: record of kunaio.get_order_book(), volume > 0 for Bid"""
+
+def _float(x):
+  """
+  Converts a numeric field of a response to float, None stays None.
+  """
+
+  return None if x is None else float(x)
+
+class Order:
+  """
+  User's order parsed from a positional list of the Kuna API v3 (see
+  kunaio.get_user_active()). Numeric fields are already converted.
+  """
+
+  __slots__ = ("id", "market", "created", "updated", "volume",
+               "initial_volume", "order_type", "status", "price",
+               "average_price", "stop_price")
+
+  def __init__(self, id, market, created, updated, volume, initial_volume,
+               order_type, status, price, average_price, stop_price=None):
+
+    self.id = id
+    self.market = market
+    self.created = created
+    self.updated = updated
+    self.volume = volume
+    self.initial_volume = initial_volume
+    self.order_type = order_type
+    self.status = status
+    self.price = price
+    self.average_price = average_price
+    self.stop_price = stop_price
+
+  @classmethod
+  def from_list(cls, row):
+    """
+    Parses an order from a list returned by get_user_active(),
+    get_user_executed() or set_order().
+
+    Args:
+      row (list): positional order fields
+
+    Returns:
+      Order
+    """
+
+    return cls(
+      id=row[0],
+      market=row[3],
+      created=row[4],
+      updated=row[5],
+      volume=_float(row[6]),
+      initial_volume=_float(row[7]),
+      order_type=row[8],
+      status=row[13],
+      price=_float(row[16]),
+      average_price=_float(row[17]),
+      stop_price=_float(row[19]) if len(row) > 19 else None,
+    )
+
+  @classmethod
+  def from_dict(cls, item):
+    """
+    Parses an order from a dict returned by cancel_order().
+
+    Args:
+      item (dict): named order fields
+
+    Returns:
+      Order
+    """
+
+    sign = -1 if item.get("side") == "sell" else 1
+    return cls(
+      id=item["id"],
+      market=item.get("symbol"),
+      created=item.get("timestamp"),
+      updated=item.get("timestamp"),
+      volume=sign * float(item.get("remaining_amount") or 0),
+      initial_volume=sign * float(item.get("original_amount") or 0),
+      order_type=(item.get("type") or "").upper(),
+      status=(item.get("state") or "").upper(),
+      price=_float(item.get("price")),
+      average_price=_float(item.get("avg_execution_price")),
+    )
+
+  @property
+  def is_active(self):
+    """
+    bool: True if the order is still on the book
+    """
+
+    return self.status.split(" ")[0] in ("ACTIVE", "PARTIALLY")
+
+  @property
+  def is_buy(self):
+    """
+    bool: True for BUY orders
+    """
+
+    return self.initial_volume > 0
+
+  def __eq__(self, other):
+
+    return isinstance(other, Order) and \
+      all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+  def __repr__(self):
+
+    return f"Order({', '.join(f'{f}={getattr(self, f)!r}' for f in self.__slots__)})"
+
+class Deal:
+  """
+  Deal of an order parsed from a positional list of the Kuna API v3 (see
+  kunaio.get_order_details()). Numeric fields are already converted.
+  """
+
+  __slots__ = ("id", "market", "time", "order_id", "volume", "price",
+               "is_maker", "fee", "fee_currency")
+
+  def __init__(self, id, market, time, order_id, volume, price, is_maker, fee,
+               fee_currency):
+
+    self.id = id
+    self.market = market
+    self.time = time
+    self.order_id = order_id
+    self.volume = volume
+    self.price = price
+    self.is_maker = is_maker
+    self.fee = fee
+    self.fee_currency = fee_currency
+
+  @classmethod
+  def from_list(cls, row):
+    """
+    Parses a deal from a list returned by get_order_details().
+
+    Args:
+      row (list): positional deal fields
+
+    Returns:
+      Deal
+    """
+
+    return cls(
+      id=row[0],
+      market=row[1],
+      time=row[2],
+      order_id=row[3],
+      volume=_float(row[4]),
+      price=_float(row[5]),
+      is_maker=row[8] == 1,
+      fee=_float(row[9]),
+      fee_currency=row[10],
+    )
+
+  def __repr__(self):
+
+    return f"Deal({', '.join(f'{f}={getattr(self, f)!r}' for f in self.__slots__)})"
+
+class Balance:
+  """
+  Wallet balance parsed from a positional list of the Kuna API v3 (see
+  kunaio.get_user_balance()). Numeric fields are already converted.
+  """
+
+  __slots__ = ("currency", "total", "available")
+
+  def __init__(self, currency, total, available):
+
+    self.currency = currency
+    self.total = total
+    self.available = available
+
+  @classmethod
+  def from_list(cls, row):
+    """
+    Parses a balance from a list returned by get_user_balance().
+
+    Args:
+      row (list): positional balance fields
+
+    Returns:
+      Balance
+    """
+
+    return cls(currency=row[1], total=_float(row[2]), available=_float(row[4]))
+
+  def __repr__(self):
+
+    return f"Balance({', '.join(f'{f}={getattr(self, f)!r}' for f in self.__slots__)})"
+
+def tickers_array(rows):
+  """
+  Converts tickers returned by get_recent_market_data() to a structured array.
+
+  Args:
+    rows (list): positional ticker fields
+
+  Returns:
+    numpy.ndarray: array of TICKER_DTYPE records
+  """
+
+  return np.array(
+    [(row[0],) + tuple(np.nan if v is None else float(v) for v in row[1:11])
+     for row in rows],
+    dtype=TICKER_DTYPE
+  )
+
+def book_array(rows):
+  """
+  Converts an order book returned by get_order_book() to a structured array.
+
+  Args:
+    rows (list): [price, volume, amount of positions] lists
+  or
+    bytes: raw JSON body of the response, parsed directly by numpy
+
+  Returns:
+    numpy.ndarray: array of BOOK_DTYPE records
+  """
+
+  if isinstance(rows, bytes):
+    # all values are numbers, so brackets are the only structure to drop
+    values = np.fromstring(rows.translate(None, b'[]" ').decode(), sep=',')
+    if len(values) % 3:
+      raise ValueError('Order book rows should have 3 values')
+    rows = values.reshape(-1, 3)
+  else:
+    rows = np.array(rows, dtype=float)
+  if len(rows) == 0:
+    return np.empty(0, dtype=BOOK_DTYPE)
+  return recfunctions.unstructured_to_structured(rows, dtype=BOOK_DTYPE)
@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import tempfile
+import threading
+
+import numpy as np
+
+import kunaio
+import kunamodels
+from kuna import Coins
+from stubserver import StubServer
+
+def point_to(url):
+  """
+  Void function that redirects kunaio and kuna.Coins to another server.
+
+  Args:
+    url (str): base URL of the server, e.g. StubServer.url
+  """
+  kunaio.DOMAIN = url + '/v3/'
+  Coins.domain = url
+
+def _book(market):
+  """
+  Fetches and decodes an order book as get_order_book(typed=True) does.
+  """
+  raw = kunaio._request('book/%s' % market, attempts=1, raw=True)
+  return kunamodels.book_array(raw) if raw.startswith(b'[') else kunaio._loads(raw)
+
+def api_load(markets, duration=10., threads=8):
+  """
+  Calls public endpoints of the API from several threads. Each request is
+  made once, errors are counted instead of retried.
+
+  Args:
+    markets (list): names of the markets for the order books
+    duration (float): [s] duration of the test
+    threads (int): amount of concurrent clients
+
+  Returns:
+    dict: endpoint -> 'requests', 'errors', 'rps' (requests per second) and
+      'p50', 'p99' latencies in seconds; 'total' is over all endpoints
+  """
+  endpoints = {
+    'timestamp': lambda: kunaio._request('timestamp', attempts=1),
+    'tickers': lambda: kunaio._request('tickers', args={'symbols': 'ALL'},
+                                       attempts=1),
+    'book': lambda: _book(random.choice(markets)),
+    'markets': lambda: kunaio._request('markets', attempts=1),
+  }
+  names = list(endpoints)
+  results = []
+
+  def client():
+    records = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+      name = random.choice(names)
+      started = time.perf_counter()
+      try:
+        response = endpoints[name]()
+        # error responses of the API are dictionaries with messages
+        ok = not (isinstance(response, dict) and 'messages' in response)
+      except Exception:
+        ok = False
+      records.append((name, time.perf_counter() - started, ok))
+    results.append(records)
+
+  pool = [threading.Thread(target=client) for _ in range(threads)]
+  for thread in pool:
+    thread.start()
+  for thread in pool:
+    thread.join()
+
+  records = [record for records in results for record in records]
+  report = {}
+  for name in names + ['total']:
+    selected = [r for r in records if name in (r[0], 'total')]
+    latencies = np.array([r[1] for r in selected])
+    report[name] = {
+      'requests': len(selected),
+      'errors': sum(not r[2] for r in selected),
+      'rps': len(selected) / duration,
+      'p50': np.percentile(latencies, 50) if len(latencies) else np.nan,
+      'p99': np.percentile(latencies, 99) if len(latencies) else np.nan,
+    }
+  return report
+
+def collector_lag(markets, sweeps=10, period=1., stub=None):
+  """
+  Runs the collector sweeps of kuna.Coins in a temporary directory and
+  measures how far it falls behind the server.
+
+  Args:
+    markets (list): names of the markets
+    sweeps (int): amount of sweeps
+    period (float): [s] minimal duration between sweeps
+    stub (StubServer): the server in this process, to count the trades those
+      are not collected
+
+  Returns:
+    dict: market -> 'p50' and 'max' of the health lag in seconds over sweeps,
+      'behind' trades those are on the server and not collected yet, 'missed'
+      trades skipped between the collected ones
+  """
+  directory = os.getcwd()
+  os.chdir(tempfile.mkdtemp(prefix='kuna-loadtest-'))
+  try:
+    coins = Coins(markets=markets)
+    lags = {market: [] for market in markets}
+    for _ in range(sweeps):
+      started = time.time()
+      coins.update_rates()
+      coins.store_pending()
+      for market, lag in coins.health()['lag'].items():
+        lags[market].append(lag)
+      time.sleep(max(0., period - (time.time() - started)))
+  finally:
+    os.chdir(directory)
+
+  report = {}
+  for market in markets:
+    IDs = coins.rates[market]
+    behind = None
+    if stub is not None:
+      stub.markets[market].update()
+      behind = stub.markets[market].last_id - max(IDs, default=0)
+    report[market] = {
+      'p50': np.percentile(lags[market], 50),
+      'max': max(lags[market]),
+      'behind': behind,
+      'missed': max(IDs) - min(IDs) + 1 - len(IDs) if IDs else 0,
+    }
+  return report
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(
+    description='Measures the clients against a local stub of the Kuna API')
+  parser.add_argument('--url', default=None,
+    help='base URL of a running stub server, a local one is started if absent')
+  parser.add_argument('--markets', type=int, default=10, help='amount of markets')
+  parser.add_argument('--rate', type=float, default=1.,
+    help='trades per second of each market')
+  parser.add_argument('--depth', type=int, default=50,
+    help='levels of each side of an order book')
+  parser.add_argument('--trades', type=int, default=100,
+    help='trades in a response of the v2 trades endpoint')
+  parser.add_argument('--latency', type=float, default=0.,
+    help='delay of each response in seconds')
+  parser.add_argument('--jitter', type=float, default=0.,
+    help='maximum random addition to the delay in seconds')
+  parser.add_argument('--errors', type=float, default=0.,
+    help='share of failed responses')
+  parser.add_argument('--duration', type=float, default=10.,
+    help='duration of the API load test in seconds')
+  parser.add_argument('--threads', type=int, default=8,
+    help='amount of concurrent API clients')
+  parser.add_argument('--sweeps', type=int, default=10,
+    help='amount of collector sweeps')
+  parser.add_argument('--period', type=float, default=1.,
+    help='minimal duration between collector sweeps in seconds')
+  args = parser.parse_args()
+
+  stub = None
+  if args.url is None:
+    stub = StubServer(markets=args.markets, rate=args.rate, depth=args.depth,
+                      trades=args.trades, latency=args.latency,
+                      jitter=args.jitter, errors=args.errors).start()
+    markets = list(stub.markets)
+    point_to(stub.url)
+  else:
+    point_to(args.url)
+    markets = [row[0] for row in kunaio._request(
+      'tickers', args={'symbols': 'ALL'}, attempts=1)]
+
+  print('%-10s %9s %7s %9s %9s %9s' % (
+    'endpoint', 'requests', 'errors', 'req/s', 'p50, ms', 'p99, ms'))
+  for name, stats in api_load(markets, args.duration, args.threads).items():
+    print('%-10s %9d %7d %9.1f %9.2f %9.2f' % (
+      name, stats['requests'], stats['errors'], stats['rps'],
+      1000 * stats['p50'], 1000 * stats['p99']))
+
+  print('\n%-10s %9s %9s %9s %9s' % ('market', 'p50 lag', 'max lag',
+                                     'behind', 'missed'))
+  for market, stats in collector_lag(markets, args.sweeps, args.period,
+                                     stub).items():
+    print('%-10s %9.2f %9.2f %9s %9d' % (
+      market, stats['p50'], stats['max'], stats['behind'], stats['missed']))
+  if stub is not None:
+    stub.stop()
@@ -0,0 +1,153 @@
+import os
+import json
+import queue
+import socket
+import struct
+import threading
+
+SOCKET_PATH = '/tmp/kuna.sock'
+"""str: default path to the Unix domain socket of the publisher"""
+QUEUE_LENGTH = 1000
+"""int: default amount of batches buffered for a subscriber"""
+
+class Publisher:
+  """
+  Publishes batches of new trades to local subscribers over a Unix domain
+  socket. Each subscriber has its own bounded queue and sender thread, so a
+  slow subscriber loses its oldest batches instead of blocking the collector.
+  An instance is a callback for Coins.add_callback().
+  """
+
+  def __init__(self, path=SOCKET_PATH, length=QUEUE_LENGTH):
+    """
+    Args:
+      path (str): path to the socket
+      length (int): amount of batches buffered for a subscriber
+    """
+    self.path = path
+    self.length = length
+    self.subscribers = []
+    self.dropped = 0
+    self.lock = threading.Lock()
+    if os.path.exists(path):
+      os.remove(path)
+    self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.server.bind(path)
+    self.server.listen()
+    threading.Thread(target=self.accept, daemon=True).start()
+
+  def accept(self):
+    """
+    Void method that accepts subscribers forever.
+    """
+    while True:
+      try:
+        connection, _ = self.server.accept()
+      except OSError:
+        # the server socket is closed
+        return
+      batches = queue.Queue(self.length)
+      with self.lock:
+        self.subscribers.append(batches)
+      threading.Thread(
+        target=self.send, args=(connection, batches), daemon=True).start()
+
+  def send(self, connection, batches):
+    """
+    Void method that sends batches to a subscriber until it disconnects.
+
+    Args:
+      connection (socket.socket): connection to the subscriber
+      batches (queue.Queue): batches for the subscriber
+    """
+    try:
+      while True:
+        message = batches.get()
+        if message is None:
+          break
+        connection.sendall(message)
+    except OSError:
+      pass
+    finally:
+      with self.lock:
+        self.subscribers.remove(batches)
+      connection.close()
+
+  def __call__(self, market, deals):
+    """
+    Void method that publishes a batch of deals of the market.
+
+    Args:
+      market (str): the market name
+      deals (dict): ID -> deal as in Coins.rates[market]
+    """
+    payload = json.dumps({'market': market, 'deals': deals}).encode()
+    message = struct.pack('<I', len(payload)) + payload
+    with self.lock:
+      subscribers = list(self.subscribers)
+    for batches in subscribers:
+      self.offer(batches, message)
+
+  def offer(self, batches, message):
+    """
+    Void method that queues a message without blocking: the oldest batch is
+    dropped if the queue of the subscriber is full.
+
+    Args:
+      batches (queue.Queue): batches for the subscriber
+      message (bytes): the message, None to stop the sender
+    """
+    while True:
+      try:
+        batches.put_nowait(message)
+        return
+      except queue.Full:
+        # the oldest batch is dropped for the slow subscriber
+        try:
+          batches.get_nowait()
+          self.dropped += 1
+        except queue.Empty:
+          pass
+
+  def close(self):
+    """
+    Void method that disconnects subscribers and removes the socket.
+    """
+    self.server.close()
+    with self.lock:
+      subscribers = list(self.subscribers)
+    for batches in subscribers:
+      self.offer(batches, None)
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+class Subscriber:
+  """
+  Receives batches of trades from a Publisher. Iterating yields
+  (market, deals) tuples, deals is a dictionary ID -> deal.
+  """
+
+  def __init__(self, path=SOCKET_PATH):
+    """
+    Args:
+      path (str): path to the socket of the publisher
+    """
+    self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.connection.connect(path)
+    self.stream = self.connection.makefile('rb')
+
+  def __iter__(self):
+    while True:
+      header = self.stream.read(4)
+      if len(header) < 4:
+        return
+      batch = json.loads(self.stream.read(struct.unpack('<I', header)[0]))
+      # JSON keys are strings, the IDs are restored
+      yield batch['market'], {int(ID): deal for ID, deal in batch['deals'].items()}
+
+  def close(self):
+    """
+    Void method that disconnects from the publisher.
+    """
+    self.stream.close()
+    self.connection.close()
@@ -0,0 +1,227 @@
+import os
+import time
+import heapq
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from storage import TRADE_DTYPE
+
+def _run_rows(path, chunk):
+  """
+  Reads a sorted run slice by slice.
+
+  Args:
+    path (str): path to the run (.npy)
+    chunk (int): amount of trades in a slice
+
+  Yields:
+    tuple: (time, id, record) of each trade
+  """
+  run = np.load(path, mmap_mode='r')
+  for i in range(0, len(run), chunk):
+    part = np.array(run[i:i + chunk])
+    for moment, ID, record in zip(part['time'].tolist(), part['id'].tolist(),
+                                  part.tolist()):
+      yield moment, ID, record
+
+def csv_trades(fileName, chunk=10000):
+  """
+  Reads trades stored by Coins.write_rates() in the time order chunk by chunk.
+  The file is in the order of collection, not of time, so it is sorted by an
+  external merge sort: sorted runs of a chunk are spilled to a temporary
+  directory and merged, the memory does not depend on the file length.
+
+  Args:
+    fileName (str): path to the CSV file
+    chunk (int): amount of trades in a chunk
+
+  Yields:
+    numpy.ndarray: arrays of TRADE_DTYPE records
+  """
+  directory = tempfile.mkdtemp(prefix='replay-')
+  try:
+    runs = []
+    for frame in pd.read_csv(fileName, chunksize=chunk):
+      trades = np.empty(len(frame), dtype=TRADE_DTYPE)
+      for field in TRADE_DTYPE.names:
+        trades[field] = frame[field].to_numpy()
+      runs.append(os.path.join(directory, '%d.npy' % len(runs)))
+      np.save(runs[-1], np.sort(trades, order=['time', 'id']))
+
+    # the slices of all runs together are not longer than a chunk
+    size = max(1, chunk // max(1, len(runs)))
+    batch = []
+    for moment, ID, record in heapq.merge(
+        *(_run_rows(path, size) for path in runs), key=lambda r: (r[0], r[1])):
+      batch.append(record)
+      if len(batch) >= chunk:
+        yield np.array(batch, dtype=TRADE_DTYPE)
+        batch = []
+    if batch:
+      yield np.array(batch, dtype=TRADE_DTYPE)
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+def _records(market, chunks):
+  """
+  Flattens chunks of trades of a market into (time, id, market, deal) tuples.
+  """
+  for trades in chunks:
+    columns = [trades[field].tolist() for field in
+               ('id', 'price', 'volume', 'funds', 'time', 'trend')]
+    for ID, price, volume, funds, moment, trend in zip(*columns):
+      yield (moment, ID, market, {
+        'price': price,
+        'volume': volume,
+        'funds': funds,
+        'time': moment,
+        'trend': trend,
+      })
+
+class Replay:
+  """
+  Replays recorded trades of several markets in the time order through the
+  same callback interface as Coins.add_callback(). Sources are read chunk by
+  chunk and merged lazily, so memory does not depend on the history length.
+  """
+
+  def __init__(self, sources, markets, start=None, end=None, speed=None,
+               batch=1000):
+    """
+    Args:
+      sources (list): storages with the iterate(market, start, end) method,
+        e.g. storage.SQLiteStorage and storage.SegmentArchive, or directories
+        with CSV files of Coins.write_rates()
+      markets (list): names of the markets
+      start (int): optional first moment of the replay, included
+      end (int): optional last moment of the replay, excluded
+      speed (float): replay speed relatively to the wall clock, the maximum
+        speed if None
+      batch (int): maximum amount of deals in a callback call
+    """
+    self.sources = sources
+    self.markets = markets
+    self.start = start
+    self.end = end
+    self.speed = speed
+    self.batch = batch
+    self.callbacks = []
+
+  def add_callback(self, callback):
+    """
+    Void method that subscribes a function to replayed deals. It is called as
+    callback(market, deals) where deals is a dictionary ID -> deal.
+
+    Args:
+      callback (function): subscriber
+    """
+    self.callbacks.append(callback)
+
+  def streams(self):
+    """
+    Returns:
+      list: iterators of (time, id, market, deal) tuples sorted by time, one
+        per market and source.
+    """
+    streams = []
+    for market in self.markets:
+      for source in self.sources:
+        if isinstance(source, str):
+          fileName = os.path.join(source, '%s.csv' % market)
+          if not os.path.isfile(fileName):
+            continue
+          start = -2**63 if self.start is None else self.start
+          end = 2**63 - 1 if self.end is None else self.end
+          chunks = (trades[(trades['time'] >= start) & (trades['time'] < end)]
+                    for trades in csv_trades(fileName))
+        else:
+          chunks = source.iterate(market, self.start, self.end)
+        streams.append(_records(market, chunks))
+    return streams
+
+  def deals(self):
+    """
+    Merges all streams into one, deals repeated in several sources are
+    skipped.
+
+    Yields:
+      tuple: (time, id, market, deal)
+    """
+    previous = None
+    for record in heapq.merge(*self.streams(), key=lambda r: (r[0], r[1])):
+      key = (record[0], record[1], record[2])
+      if key != previous:
+        previous = key
+        yield record
+
+  def run(self):
+    """
+    Replays the deals.
+
+    Returns:
+      int: amount of replayed deals
+    """
+    count = 0
+    market, deals = None, {}
+    first, started = None, time.time()
+
+    def flush():
+      if deals:
+        for callback in self.callbacks:
+          callback(market, deals)
+
+    for moment, ID, current, deal in self.deals():
+      if self.speed:
+        if first is None:
+          first = moment
+        delay = (moment - first) / self.speed - (time.time() - started)
+        if delay > 0:
+          # deals are delivered before the wait
+          flush()
+          market, deals = None, {}
+          time.sleep(delay)
+      if (current != market) or (len(deals) >= self.batch):
+        flush()
+        market, deals = current, {}
+      deals[ID] = deal
+      count += 1
+    flush()
+    return count
+
+if __name__ == '__main__':
+  import csv
+  import sys
+  import argparse
+
+  from storage import SQLiteStorage, SegmentArchive
+
+  parser = argparse.ArgumentParser(
+    description='Exports recorded trades in the time order as CSV')
+  parser.add_argument('markets', nargs='+', help='names of the markets')
+  parser.add_argument('--sqlite', help='path to the SQLite storage')
+  parser.add_argument('--archive', help='directory of the archive segments')
+  parser.add_argument('--csv', help='directory of the CSV files')
+  parser.add_argument('--start', type=int, help='first moment, included')
+  parser.add_argument('--end', type=int, help='last moment, excluded')
+  parser.add_argument('--speed', type=float,
+    help='replay speed relatively to the wall clock, the maximum if absent')
+  args = parser.parse_args()
+
+  sources = []
+  if args.archive:
+    sources.append(SegmentArchive(args.archive))
+  if args.sqlite:
+    sources.append(SQLiteStorage(args.sqlite))
+  if args.csv:
+    sources.append(args.csv)
+
+  writer = csv.writer(sys.stdout)
+  writer.writerow(['market', 'id', 'price', 'volume', 'funds', 'time', 'trend'])
+  replay = Replay(sources, args.markets, args.start, args.end, args.speed)
+  replay.add_callback(lambda market, deals: writer.writerows(
+    [market, ID, deal['price'], deal['volume'], deal['funds'], deal['time'],
+     deal['trend']] for ID, deal in deals.items()))
+  replay.run()
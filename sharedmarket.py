@@ -0,0 +1,240 @@
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+import kunaio
+from kunamodels import TICKER_DTYPE, BOOK_DTYPE
+
+SHARED_NAME = 'kuna_market'
+"""str: default name of the shared memory block"""
+HEADER_DTYPE = np.dtype([
+  ('version', 'u8'),
+  ('time', 'f8'),
+  ('markets', 'u8'),
+  ('depth', 'u8'),
+  ('count', 'u8'),
+])
+"""numpy.dtype: header of the block. The version is odd while the block is
+written, 'markets' and 'depth' are the capacity, 'count' the used markets"""
+_CREATED = set()
+"""set: names of the blocks created by the writers of this process"""
+
+def _layout(buffer, markets, depth):
+  """
+  Maps structured arrays on the buffer.
+
+  Args:
+    buffer (memoryview): buffer of the shared memory block
+    markets (int): maximum amount of markets
+    depth (int): maximum amount of levels of each side of a book
+
+  Returns:
+    tuple: header, tickers, books and sizes arrays. books[i, 0] are bids and
+      books[i, 1] asks of the market tickers[i], sizes[i] are the amounts of
+      filled levels
+  """
+  offset = 0
+  arrays = []
+  for dtype, shape in ((HEADER_DTYPE, (1,)), (TICKER_DTYPE, (markets,)),
+                       (BOOK_DTYPE, (markets, 2, depth)), (np.dtype('i8'), (markets, 2))):
+    count = int(np.prod(shape))
+    arrays.append(np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset))
+    offset += count * dtype.itemsize
+  return tuple(arrays)
+
+def _size(markets, depth):
+  """
+  Returns:
+    int: size in bytes of the block for the capacity.
+  """
+  return HEADER_DTYPE.itemsize + markets * TICKER_DTYPE.itemsize + \
+         markets * 2 * depth * BOOK_DTYPE.itemsize + markets * 2 * 8
+
+class MarketWriter:
+  """
+  The only writer of the latest tickers and top levels of the order books in
+  a shared memory block. Writes are guarded by a seqlock: the version is odd
+  during a write, so readers can detect and repeat torn reads.
+  """
+
+  def __init__(self, name=SHARED_NAME, markets=256, depth=10):
+    """
+    Args:
+      name (str): name of the shared memory block
+      markets (int): maximum amount of markets
+      depth (int): maximum amount of levels of each side of a book
+    """
+    self.memory = shared_memory.SharedMemory(
+      name=name, create=True, size=_size(markets, depth))
+    _CREATED.add(self.memory.name)
+    self.header, self.tickers, self.books, self.sizes = \
+      _layout(self.memory.buf, markets, depth)
+    self.header[0] = (0, 0., markets, depth, 0)
+
+  def write(self, tickers, books):
+    """
+    Void method that publishes a new snapshot.
+
+    Args:
+      tickers (numpy.ndarray): array of TICKER_DTYPE records
+      books (dict): market name -> array of BOOK_DTYPE records as returned by
+        kunaio.get_order_book(typed=True)
+    """
+    markets, depth = len(self.tickers), self.books.shape[2]
+    tickers = tickers[:markets]
+    self.header['version'] += 1
+    self.tickers[:len(tickers)] = tickers
+    self.sizes[:] = 0
+    for i, ticker in enumerate(tickers['ticker']):
+      book = books.get(ticker)
+      if book is None:
+        continue
+      bids = np.sort(book[book['volume'] > 0], order='price')[::-1][:depth]
+      asks = np.sort(book[book['volume'] < 0], order='price')[:depth]
+      self.books[i, 0, :len(bids)] = bids
+      self.books[i, 1, :len(asks)] = asks
+      self.sizes[i] = (len(bids), len(asks))
+    self.header['count'] = len(tickers)
+    self.header['time'] = time.time()
+    self.header['version'] += 1
+
+  def close(self):
+    """
+    Void method that removes the block.
+    """
+    self.memory.close()
+    self.memory.unlink()
+    _CREATED.discard(self.memory.name)
+
+class MarketReader:
+  """
+  Reader of the block written by MarketWriter. Any number of processes can
+  read it without network requests.
+  """
+
+  def __init__(self, name=SHARED_NAME):
+    """
+    Args:
+      name (str): name of the shared memory block
+    """
+    try:
+      # the block belongs to the writer, it should not be removed on our exit
+      self.memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+      # before Python 3.13 attaching registers the block for the removal, a
+      # writer in the same process shares the registration and removes it
+      self.memory = shared_memory.SharedMemory(name=name)
+      if self.memory.name not in _CREATED:
+        resource_tracker.unregister(self.memory._name, 'shared_memory')
+    header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self.memory.buf)
+    self.header, self.tickers, self.books, self.sizes = _layout(
+      self.memory.buf, int(header['markets'][0]), int(header['depth'][0]))
+
+  def read(self, function, timeout=1.):
+    """
+    Calls the function on the arrays of the block without copying them and
+    repeats the call if the block was written meanwhile.
+
+    Args:
+      function (function): called as function(tickers, books, sizes) with
+        views of the used part of the block. It should not keep the views.
+      timeout (float): [s] maximal duration of the retries, a writer which
+        died in the middle of a write leaves the version odd forever
+
+    Returns:
+      object: result of the consistent call
+
+    Raises:
+      TimeoutError: no consistent read within the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      if time.monotonic() > deadline:
+        raise TimeoutError('no consistent read of %s' % self.memory.name)
+      version = int(self.header['version'][0])
+      if version % 2:
+        time.sleep(0)
+        continue
+      count = int(self.header['count'][0])
+      result = function(self.tickers[:count], self.books[:count],
+                        self.sizes[:count])
+      if int(self.header['version'][0]) == version:
+        return result
+
+  def snapshot(self, timeout=1.):
+    """
+    Args:
+      timeout (float): [s] see read()
+
+    Returns:
+      tuple: consistent copies of the tickers, books and sizes arrays.
+    """
+    return self.read(lambda tickers, books, sizes:
+                     (tickers.copy(), books.copy(), sizes.copy()), timeout)
+
+  @property
+  def age(self):
+    """
+    float: [s] time since the last write
+    """
+    return time.time() - float(self.header['time'][0])
+
+  def close(self):
+    """
+    Void method that detaches from the block.
+    """
+    self.memory.close()
+
+def run_fetcher(name=SHARED_NAME, markets=None, depth=10, interval=1.,
+                headroom=2.):
+  """
+  Void function that fetches tickers and order books forever and writes them
+  to the shared memory block. If the markets outgrow the block, it is created
+  again with more room under the same name: readers of the old block see it
+  stop updating (MarketReader.age grows) and should attach again.
+
+  Args:
+    name (str): name of the shared memory block
+    markets (list): names of the markets, all markets if None
+    depth (int): amount of levels of each side of a book
+    interval (float): [s] minimal duration between snapshots
+    headroom (float): capacity of the block relatively to the amount of
+      markets, new markets are listed on the server from time to time
+  """
+  writer = None
+  try:
+    while True:
+      started = time.time()
+      tickers = kunaio.get_recent_market_data(markets or "ALL", typed=True)
+      # an error response is a dictionary, the snapshot is skipped
+      if isinstance(tickers, np.ndarray):
+        if (writer is None) or (len(tickers) > len(writer.tickers)):
+          if writer is not None:
+            writer.close()
+          writer = MarketWriter(name, int(headroom * len(tickers)) + 1, depth)
+        books = {}
+        for ticker in tickers['ticker']:
+          book = kunaio.get_order_book(ticker, typed=True)
+          if isinstance(book, np.ndarray):
+            books[ticker] = book
+        writer.write(tickers, books)
+      time.sleep(max(0., interval - (time.time() - started)))
+  finally:
+    if writer is not None:
+      writer.close()
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(
+    description='Shares the latest tickers and order books of kuna.io')
+  parser.add_argument('markets', nargs='*', help='names of the markets')
+  parser.add_argument('--name', default=SHARED_NAME,
+    help='name of the shared memory block')
+  parser.add_argument('--depth', type=int, default=10,
+    help='amount of levels of each side of a book')
+  parser.add_argument('--interval', type=float, default=1.,
+    help='minimal duration between snapshots in seconds')
+  args = parser.parse_args()
+  run_fetcher(args.name, args.markets or None, args.depth, args.interval)
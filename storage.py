@@ -0,0 +1,692 @@
+import os
+import json
+import zlib
+import struct
+import sqlite3
+import threading
+
+import numpy as np
+
+TRADE_DTYPE = np.dtype([
+  ('id', 'i8'),
+  ('price', 'f8'),
+  ('volume', 'f8'),
+  ('funds', 'f8'),
+  ('time', 'i8'),
+  ('trend', 'U8'),
+])
+"""numpy.dtype: record of a stored trade"""
+
+class SQLiteStorage:
+  """
+  Storage of trades in a SQLite database in the WAL mode, so readers of other
+  connections are not blocked by the collector. Trades are indexed by market
+  and time, duplicates by the trade ID are ignored.
+  """
+
+  def __init__(self, path='trades.db'):
+    """
+    Args:
+      path (str): path to the database file
+    """
+    self.path = path
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute('PRAGMA synchronous=NORMAL')
+    self.connection.execute(
+      'CREATE TABLE IF NOT EXISTS trades ('
+      'market TEXT NOT NULL, id INTEGER NOT NULL, price REAL, volume REAL, '
+      'funds REAL, time INTEGER NOT NULL, trend TEXT, PRIMARY KEY (market, id))'
+    )
+    self.connection.execute(
+      'CREATE INDEX IF NOT EXISTS trades_market_time ON trades (market, time)'
+    )
+    self.connection.commit()
+
+  def write(self, trades):
+    """
+    Stores trades of all markets in a single transaction.
+
+    Args:
+      trades (dict): market name -> list of (id, price, volume, funds, time,
+        trend) tuples
+
+    Returns:
+      int: amount of stored trades, without ignored duplicates
+    """
+    with self.lock, self.connection:
+      before = self.connection.total_changes
+      for market, rows in trades.items():
+        self.connection.executemany(
+          'INSERT OR IGNORE INTO trades '
+          '(market, id, price, volume, funds, time, trend) '
+          'VALUES (?, ?, ?, ?, ?, ?, ?)',
+          [(market,) + tuple(row) for row in rows]
+        )
+      return self.connection.total_changes - before
+
+  def read(self, market, start=None, end=None):
+    """
+    Reads trades of the market in the time range ordered by time.
+
+    Args:
+      market (str): the market name
+      start (int): optional first moment of the range, included
+      end (int): optional last moment of the range, excluded
+
+    Returns:
+      numpy.ndarray: array of TRADE_DTYPE records
+    """
+    query = 'SELECT id, price, volume, funds, time, trend FROM trades ' \
+            'WHERE market = ? AND time >= ? AND time < ? ORDER BY time, id'
+    with self.lock:
+      rows = self.connection.execute(query, (
+        market,
+        -2**63 if start is None else start,
+        2**63 - 1 if end is None else end,
+      )).fetchall()
+    return np.array(rows, dtype=TRADE_DTYPE)
+
+  def iterate(self, market, start=None, end=None, chunk=10000):
+    """
+    Reads trades of the market in the time range ordered by time, chunk by
+    chunk, so the memory does not depend on the range.
+
+    Args:
+      market (str): the market name
+      start (int): optional first moment of the range, included
+      end (int): optional last moment of the range, excluded
+      chunk (int): amount of trades in a chunk
+
+    Yields:
+      numpy.ndarray: arrays of TRADE_DTYPE records
+    """
+    # a separate connection lets the collector write during the iteration
+    connection = sqlite3.connect(self.path)
+    try:
+      cursor = connection.execute(
+        'SELECT id, price, volume, funds, time, trend FROM trades '
+        'WHERE market = ? AND time >= ? AND time < ? ORDER BY time, id', (
+          market,
+          -2**63 if start is None else start,
+          2**63 - 1 if end is None else end,
+        ))
+      while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+          break
+        yield np.array(rows, dtype=TRADE_DTYPE)
+    finally:
+      connection.close()
+
+  def markets(self):
+    """
+    Returns:
+      list: names of the stored markets
+    """
+    with self.lock:
+      return [row[0] for row in
+              self.connection.execute('SELECT DISTINCT market FROM trades')]
+
+  def close(self):
+    """
+    Void method that closes the database.
+    """
+    with self.lock:
+      self.connection.close()
+
+BAR_DTYPE = np.dtype([
+  ('time', 'i8'),
+  ('open', 'f8'),
+  ('high', 'f8'),
+  ('low', 'f8'),
+  ('close', 'f8'),
+  ('volume', 'f8'),
+  ('funds', 'f8'),
+  ('count', 'i8'),
+])
+"""numpy.dtype: record of an aggregated bar, time is the start of the bar"""
+
+TIERS = (
+  # name, seconds in a bar, seconds to keep, seconds between compactions
+  ('1m', 60, 6 * 604800, 3600),
+  ('1h', 3600, 52 * 604800, 86400),
+  ('1d', 86400, None, None),
+)
+"""tuple: retention tiers from the finest to the coarsest. Bars older than the
+keeping interval are rolled up into the next tier, the last tier is kept
+forever"""
+
+def rollup(trades, seconds):
+  """
+  Aggregates trades into bars.
+
+  Args:
+    trades (numpy.ndarray): array of TRADE_DTYPE records
+    seconds (int): duration of a bar
+
+  Returns:
+    numpy.ndarray: array of BAR_DTYPE records sorted by time
+  """
+  bars = np.empty(len(trades), dtype=BAR_DTYPE)
+  bars['time'] = trades['time']
+  for field in ('open', 'high', 'low', 'close'):
+    bars[field] = trades['price']
+  bars['volume'] = trades['volume']
+  bars['funds'] = trades['funds']
+  bars['count'] = 1
+  return merge_bars(bars, seconds)
+
+def merge_bars(bars, seconds):
+  """
+  Aggregates bars into bars of the same or longer duration. Bars with the
+  same start are merged, so fresh bars can be appended to stored ones.
+
+  Args:
+    bars (numpy.ndarray): array of BAR_DTYPE records
+    seconds (int): duration of a result bar
+
+  Returns:
+    numpy.ndarray: array of BAR_DTYPE records sorted by time
+  """
+  if len(bars) == 0:
+    return np.empty(0, dtype=BAR_DTYPE)
+  bars = bars[np.argsort(bars['time'], kind='stable')]
+  starts = bars['time'] // seconds * seconds
+  starts, first = np.unique(starts, return_index=True)
+  last = np.append(first[1:], len(bars)) - 1
+
+  result = np.empty(len(starts), dtype=BAR_DTYPE)
+  result['time'] = starts
+  result['open'] = bars['open'][first]
+  result['close'] = bars['close'][last]
+  result['high'] = np.maximum.reduceat(bars['high'], first)
+  result['low'] = np.minimum.reduceat(bars['low'], first)
+  for field in ('volume', 'funds', 'count'):
+    result[field] = np.add.reduceat(bars[field], first)
+  return result
+
+class Retention:
+  """
+  Tiered retention of trades those are older than the raw window: they are
+  rolled up into minute bars, minute bars into hour bars and hour bars into
+  daily bars, see TIERS. Each tier is compacted on its own schedule. All tiers
+  of a market are kept in one .npz file together with the ID of the last
+  rolled up trade, so trades restored from an older checkpoint are not
+  counted twice.
+  """
+
+  def __init__(self, directory='.', tiers=TIERS):
+    """
+    Args:
+      directory (str): directory of the bar files
+      tiers (tuple): retention tiers, see TIERS
+    """
+    self.directory = directory
+    self.tiers = tiers
+    # market -> tier name -> bars
+    self.bars = {}
+    # market -> ID of the last rolled up trade
+    self.rolled = {}
+    # market -> time of the newest rolled up trade
+    self.newest = {}
+    # market -> tier name -> moment of the last compaction
+    self.compacted = {}
+
+  def get_file_name(self, market, tier=None):
+    """
+    Returns:
+      str: path to the file with bars of the market, or to the legacy file
+        of a single tier.
+    """
+    if tier is None:
+      return os.path.join(self.directory, '%s.bars.npz' % market)
+    return os.path.join(self.directory, '%s.%s.npy' % (market, tier))
+
+  def load(self, market):
+    """
+    Void method that reads bars of the market from the file once.
+    """
+    if market in self.bars:
+      return
+    self.bars[market] = {}
+    self.rolled[market] = -1
+    self.compacted[market] = {}
+    fileName = self.get_file_name(market)
+    if os.path.isfile(fileName):
+      with np.load(fileName) as arrays:
+        for tier in arrays.files:
+          if tier == 'rolled':
+            self.rolled[market] = int(arrays[tier])
+          else:
+            self.bars[market][tier] = arrays[tier]
+    else:
+      # files of a single tier written before the watermark was stored
+      for tier in self.tiers:
+        fileName = self.get_file_name(market, tier[0])
+        if os.path.isfile(fileName):
+          self.bars[market][tier[0]] = np.load(fileName)
+    # the newest stored bar is the best guess before new trades are added
+    times = [int(bars['time'].max()) for bars in self.bars[market].values()
+             if len(bars)]
+    if times:
+      self.newest[market] = max(times)
+
+  def get(self, market, tier):
+    """
+    Returns:
+      numpy.ndarray: bars of the market and tier.
+    """
+    self.load(market)
+    return self.bars[market].setdefault(tier, np.empty(0, dtype=BAR_DTYPE))
+
+  def add(self, market, trades):
+    """
+    Rolls expired trades up into the finest tier. Trades those are already
+    rolled up are skipped.
+
+    Args:
+      market (str): the market name
+      trades (numpy.ndarray): array of TRADE_DTYPE records
+
+    Returns:
+      numpy.ndarray: the trades those were rolled up now
+    """
+    self.load(market)
+    trades = trades[trades['id'] > self.rolled[market]]
+    if len(trades):
+      name, seconds = self.tiers[0][:2]
+      self.bars[market][name] = merge_bars(np.concatenate(
+        [self.get(market, name), rollup(trades, seconds)]), seconds)
+      self.rolled[market] = int(trades['id'].max())
+      self.newest[market] = max(self.newest.get(market, 0),
+                                int(trades['time'].max()))
+    return trades
+
+  def compact(self, now=None):
+    """
+    Moves expired bars of all markets to the next tier if the tier of the
+    market is due to compaction.
+
+    Args:
+      now (int): optional current time in the time scale of trades, by
+        default the time of the newest rolled up trade of each market, so a
+        stalled market is not compacted by the clock of another one
+
+    Returns:
+      set: names of the markets those bars were moved, see write()
+    """
+    changed = set()
+    for market in list(self.bars):
+      moment = self.newest.get(market) if now is None else now
+      if moment is None:
+        continue
+      compacted = self.compacted[market]
+      for i in range(len(self.tiers) - 1):
+        name, seconds, keep, period = self.tiers[i]
+        if (name in compacted) and (moment - compacted[name] < period):
+          continue
+        compacted[name] = moment
+        next_name, next_seconds = self.tiers[i + 1][:2]
+        bars = self.get(market, name)
+        expired = bars['time'] < moment - keep
+        if expired.any():
+          self.bars[market][next_name] = merge_bars(np.concatenate(
+            [self.get(market, next_name), bars[expired]]), next_seconds)
+          self.bars[market][name] = bars[~expired]
+          changed.add(market)
+    return changed
+
+  def write(self, market):
+    """
+    Void method that atomically stores all tiers of the market and the ID of
+    the last rolled up trade.
+    """
+    if market not in self.bars:
+      return
+    fileName = self.get_file_name(market)
+    # np.savez adds the extension if it is absent
+    temporary = fileName[:-4] + '.tmp.npz'
+    np.savez(temporary, rolled=np.array(self.rolled[market]),
+             **self.bars[market])
+    os.replace(temporary, fileName)
+    for tier in self.tiers:
+      legacy = self.get_file_name(market, tier[0])
+      if os.path.isfile(legacy):
+        os.remove(legacy)
+
+def _codec():
+  """
+  Picks up the best available compression.
+
+  Returns:
+    tuple: name, compress function and decompress function
+  """
+  try:
+    import zstandard
+    return ('zstd', zstandard.ZstdCompressor(level=9).compress,
+            zstandard.ZstdDecompressor().decompress)
+  except ImportError:
+    pass
+  try:
+    import lz4.frame
+    return ('lz4', lz4.frame.compress, lz4.frame.decompress)
+  except ImportError:
+    pass
+  return ('zlib', lambda data: zlib.compress(data, 9), zlib.decompress)
+
+def _decompressor(name):
+  """
+  Returns:
+    function: decompress function of the codec stored in a segment.
+  """
+  if name == 'zstd':
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress
+  if name == 'lz4':
+    import lz4.frame
+    return lz4.frame.decompress
+  return zlib.decompress
+
+class SegmentArchive:
+  """
+  Archive of cold trades in compressed columnar segments. IDs and times are
+  delta encoded, prices, volumes and funds are stored in fixed point and
+  trends as codes. A segment file name holds the market and the time range,
+  so reads skip segments out of the range without opening them. Segments
+  cover no more than a span of time each. Trades of an open span are appended
+  to an uncompressed tail file of the span, which is compressed into a
+  segment once a later span is written or the tail reaches the length, so a
+  write costs only the new trades.
+  """
+
+  SCALE = 10**8
+  """int: fixed point scale of prices, volumes and funds"""
+
+  def __init__(self, directory='archive', span=86400, length=1000000):
+    """
+    Args:
+      directory (str): directory of the segment files
+      span (int): time span of a segment in the time scale of trades
+      length (int): maximum amount of trades in a segment
+    """
+    self.directory = directory
+    self.span = span
+    self.length = length
+    self.codec, self.compress, _ = _codec()
+    os.makedirs(directory, exist_ok=True)
+
+  def segments(self, market, start=None, end=None):
+    """
+    Lists segments and tails of the market those intersect the time range.
+    The range of a tail is the whole span.
+
+    Args:
+      market (str): the market name
+      start (int): optional first moment of the range, included
+      end (int): optional last moment of the range, excluded
+
+    Returns:
+      list: (first time, last time, path) tuples sorted by time
+    """
+    result = []
+    for fileName in os.listdir(self.directory):
+      parts = fileName.split('.')
+      if (len(parts) != 4) or (parts[0] != market) or \
+         (parts[3] not in ('seg', 'tail')):
+        continue
+      first, last = int(parts[1]), int(parts[2])
+      if ((start is None) or (last >= start)) and ((end is None) or (first < end)):
+        result.append((first, last, os.path.join(self.directory, fileName)))
+    result.sort()
+    return result
+
+  def write(self, market, trades):
+    """
+    Stores trades. Trades of a span are appended to the tail of the span, so
+    frequent small writes neither produce a file each nor rewrite the open
+    segment. Tails of the earlier spans of the market are sealed.
+
+    Args:
+      market (str): the market name
+      trades (numpy.ndarray): array of TRADE_DTYPE records
+
+    Returns:
+      str: path to the last written tail or segment or None if there are no
+        trades
+    """
+    if len(trades) == 0:
+      return None
+    trades = np.sort(trades, order=['time', 'id'])
+    spans = trades['time'] // self.span
+    fileName = None
+    for span in np.unique(spans):
+      fileName = self.append(market, trades[spans == span])
+    # the earlier spans are closed, later trades of them are not expected
+    self.seal(market, int(spans[-1]) * self.span)
+    return fileName
+
+  def get_tail_name(self, market, span):
+    """
+    Returns:
+      str: path to the tail file of the span of the market.
+    """
+    return os.path.join(self.directory, '%s.%d.%d.tail' % (
+      market, span * self.span, (span + 1) * self.span - 1))
+
+  def append(self, market, trades):
+    """
+    Appends trades of a single span to the tail of the span. The tail is
+    sealed into a segment when it reaches the length.
+
+    Args:
+      market (str): the market name
+      trades (numpy.ndarray): array of TRADE_DTYPE records sorted by time
+
+    Returns:
+      str: path to the tail or to the segment if the tail was sealed
+    """
+    fileName = self.get_tail_name(market, int(trades['time'][0]) // self.span)
+    size = TRADE_DTYPE.itemsize
+    with open(fileName, 'ab') as f:
+      # a record torn by a crash is dropped
+      whole = f.tell() - f.tell() % size
+      if whole != f.tell():
+        f.truncate(whole)
+      f.write(np.ascontiguousarray(trades, dtype=TRADE_DTYPE).tobytes())
+      count = f.tell() // size
+    if count >= self.length:
+      return self.seal_tail(market, fileName)
+    return fileName
+
+  def read_tail(self, fileName):
+    """
+    Reads a tail file.
+
+    Args:
+      fileName (str): path to the tail
+
+    Returns:
+      numpy.ndarray: array of TRADE_DTYPE records sorted by time, trades
+        appended twice, e.g. after a crash, are kept once
+    """
+    with open(fileName, 'rb') as f:
+      data = f.read()
+    trades = np.frombuffer(data, dtype=TRADE_DTYPE,
+                           count=len(data) // TRADE_DTYPE.itemsize)
+    trades = trades[np.unique(trades['id'], return_index=True)[1]]
+    return np.sort(trades, order=['time', 'id'])
+
+  def seal_tail(self, market, fileName):
+    """
+    Compresses a tail into segments of no more than the length and removes
+    the tail.
+
+    Args:
+      market (str): the market name
+      fileName (str): path to the tail
+
+    Returns:
+      str: path to the last segment or None if the tail was empty
+    """
+    trades = self.read_tail(fileName)
+    segment = None
+    for i in range(0, len(trades), self.length):
+      segment = self.write_segment(market, trades[i:i + self.length])
+    os.remove(fileName)
+    return segment
+
+  def seal(self, market=None, before=None):
+    """
+    Void method that compresses tails into segments, e.g. before the archive
+    is copied elsewhere.
+
+    Args:
+      market (str): optional market name, all markets if None
+      before (int): optional moment, only tails of the spans those end before
+        it are sealed
+    """
+    for name in ([market] if market else self.markets()):
+      for first, last, path in self.segments(name, end=before):
+        if path.endswith('.tail') and ((before is None) or (last < before)):
+          self.seal_tail(name, path)
+
+  def write_segment(self, market, trades):
+    """
+    Stores trades as a segment.
+
+    Args:
+      market (str): the market name
+      trades (numpy.ndarray): array of TRADE_DTYPE records
+
+    Returns:
+      str: path to the segment
+    """
+    trades = np.sort(trades, order=['time', 'id'])
+    trends, codes = np.unique(trades['trend'], return_inverse=True)
+    columns = [
+      np.diff(trades['id'], prepend=0),
+      np.diff(trades['time'], prepend=0),
+    ] + [
+      np.diff(np.round(trades[field] * self.SCALE).astype('i8'), prepend=0)
+      for field in ('price', 'volume', 'funds')
+    ]
+    blob = b''.join(column.astype('<i8').tobytes() for column in columns)
+    blob += codes.astype('u1').tobytes()
+    header = json.dumps({
+      'codec': self.codec,
+      'count': len(trades),
+      'scale': self.SCALE,
+      'trends': trends.tolist(),
+    }).encode()
+
+    first, last = int(trades['time'][0]), int(trades['time'][-1])
+    fileName = os.path.join(self.directory, '%s.%d.%d.seg' % (market, first, last))
+    # segments with the same range are merged
+    if os.path.isfile(fileName):
+      merged = np.concatenate([self.read_segment(fileName), trades])
+      merged = merged[np.unique(merged['id'], return_index=True)[1]]
+      if len(merged) > len(trades):
+        os.remove(fileName)
+        return self.write_segment(market, merged)
+    with open(fileName + '.tmp', 'wb') as f:
+      f.write(struct.pack('<I', len(header)) + header + self.compress(blob))
+    os.replace(fileName + '.tmp', fileName)
+    return fileName
+
+  def read_segment(self, fileName):
+    """
+    Decodes a segment.
+
+    Args:
+      fileName (str): path to the segment
+
+    Returns:
+      numpy.ndarray: array of TRADE_DTYPE records sorted by time
+    """
+    with open(fileName, 'rb') as f:
+      data = f.read()
+    length = struct.unpack('<I', data[:4])[0]
+    header = json.loads(data[4:4 + length])
+    blob = _decompressor(header['codec'])(data[4 + length:])
+    count = header['count']
+
+    columns = np.frombuffer(blob, dtype='<i8', count=5 * count).reshape(5, count)
+    columns = np.cumsum(columns, axis=1)
+    trades = np.empty(count, dtype=TRADE_DTYPE)
+    trades['id'] = columns[0]
+    trades['time'] = columns[1]
+    for i, field in enumerate(('price', 'volume', 'funds')):
+      trades[field] = columns[2 + i] / header['scale']
+    codes = np.frombuffer(blob, dtype='u1', offset=5 * 8 * count)
+    trades['trend'] = np.array(header['trends'], dtype='U8')[codes]
+    return trades
+
+  def load(self, fileName):
+    """
+    Returns:
+      numpy.ndarray: trades of a segment or of a tail sorted by time.
+    """
+    if fileName.endswith('.tail'):
+      return self.read_tail(fileName)
+    return self.read_segment(fileName)
+
+  def iterate(self, market, start=None, end=None):
+    """
+    Reads trades of the market in the time range segment by segment. Only
+    segments those intersect the range are decompressed.
+
+    Args:
+      market (str): the market name
+      start (int): optional first moment of the range, included
+      end (int): optional last moment of the range, excluded
+
+    Yields:
+      numpy.ndarray: arrays of TRADE_DTYPE records
+    """
+    for first, last, path in self.segments(market, start, end):
+      trades = self.load(path)
+      mask = np.ones(len(trades), dtype=bool)
+      if start is not None:
+        mask &= trades['time'] >= start
+      if end is not None:
+        mask &= trades['time'] < end
+      yield trades[mask]
+
+  def markets(self):
+    """
+    Returns:
+      list: names of the archived markets
+    """
+    return sorted({fileName.split('.')[0] for fileName in
+                   os.listdir(self.directory)
+                   if fileName.endswith(('.seg', '.tail'))})
+
+  def read(self, market, start=None, end=None):
+    """
+    Reads trades of the market in the time range. Only segments those
+    intersect the range are decompressed.
+
+    Args:
+      market (str): the market name
+      start (int): optional first moment of the range, included
+      end (int): optional last moment of the range, excluded
+
+    Returns:
+      numpy.ndarray: array of TRADE_DTYPE records sorted by time
+    """
+    parts = [self.load(path) for first, last, path in
+             self.segments(market, start, end)]
+    if not parts:
+      return np.empty(0, dtype=TRADE_DTYPE)
+    trades = np.sort(np.concatenate(parts), order=['time', 'id'])
+    # a trade archived twice, e.g. after a crash, is returned once
+    trades = trades[np.unique(trades['id'], return_index=True)[1]]
+    trades = np.sort(trades, order=['time', 'id'])
+    mask = np.ones(len(trades), dtype=bool)
+    if start is not None:
+      mask &= trades['time'] >= start
+    if end is not None:
+      mask &= trades['time'] < end
+    return trades[mask]
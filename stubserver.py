@@ -0,0 +1,403 @@
+import json
+import time
+import random
+import threading
+import collections
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HISTORY_LENGTH = 10000
+"""int: amount of the latest trades kept for each market"""
+
+class StubMarket:
+  """
+  Simulated market: the price is a random walk and trades appear with a
+  constant rate when the market is requested.
+  """
+
+  def __init__(self, name, price=100., rate=1.):
+    """
+    Args:
+      name (str): the market name
+      price (float): initial price
+      rate (float): trades per second
+    """
+    self.name = name
+    self.price = price
+    self.rate = rate
+    self.trades = collections.deque(maxlen=HISTORY_LENGTH)
+    self.last_id = 0
+    self.generated = time.time()
+    self.lock = threading.Lock()
+
+  def update(self):
+    """
+    Void method that generates trades since the previous call.
+    """
+    with self.lock:
+      now = time.time()
+      count = int((now - self.generated) * self.rate)
+      if count <= 0:
+        return
+      self.generated += count / self.rate
+      for i in range(count):
+        self.last_id += 1
+        change = random.gauss(0, 0.001)
+        self.price *= 1 + change
+        volume = round(random.expovariate(1.), 6)
+        moment = self.generated - (count - 1 - i) / self.rate
+        self.trades.append({
+          'id': self.last_id,
+          'price': '%.6f' % self.price,
+          'volume': '%.6f' % volume,
+          'funds': '%.6f' % (self.price * volume),
+          'market': self.name,
+          'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(moment)),
+          'trend': 'up' if change >= 0 else 'down',
+          'side': None,
+        })
+
+  def history(self, since=None, limit=None, ascending=False):
+    """
+    Returns:
+      list: trades in the format of the v2 trades endpoint
+    """
+    self.update()
+    with self.lock:
+      trades = list(self.trades)
+    if since is not None:
+      trades = [trade for trade in trades if trade['id'] > since]
+    if not ascending:
+      trades.reverse()
+    return trades[:limit] if limit else trades
+
+  def book(self, depth):
+    """
+    Returns:
+      list: [price, volume, amount of positions] levels, volume > 0 for bids
+    """
+    self.update()
+    bids = [[round(self.price * (1 - 0.001 * (i + 1)), 6),
+             round(random.expovariate(1.), 6), random.randint(1, 5)]
+            for i in range(depth)]
+    asks = [[round(self.price * (1 + 0.001 * (i + 1)), 6),
+             -round(random.expovariate(1.), 6), random.randint(1, 5)]
+            for i in range(depth)]
+    return bids + asks
+
+  def ticker(self):
+    """
+    Returns:
+      list: ticker in the format of the v3 tickers endpoint
+    """
+    self.update()
+    return [self.name, self.price * 0.999, 10., self.price * 1.001, 10., 0., 0.,
+            self.price, 100. * self.rate, self.price * 1.05, self.price * 0.95]
+
+class StubServer:
+  """
+  Local HTTP server that imitates the Kuna API: the v3 endpoints of kunaio
+  and the v2 endpoints of kuna.Coins. Signatures of private requests are not
+  checked. The latency, the share of failed responses and the payload sizes
+  are configurable to measure the clients without kuna.io.
+  """
+
+  def __init__(self, host='127.0.0.1', port=0, markets=10, rate=1., depth=50,
+               trades=100, latency=0., jitter=0., errors=0.):
+    """
+    Args:
+      host (str): address to listen
+      port (int): port to listen, a free one if 0
+      markets (list): names of the markets
+    or
+      int: amount of markets with generated names quoted in uah
+      rate (float): trades per second of each market
+      depth (int): levels of each side of an order book
+      trades (int): trades in a response of the v2 trades endpoint without
+        the 'from' argument
+      latency (float): [s] delay of each response
+      jitter (float): [s] maximum random addition to the delay
+      errors (float): share of responses failed with the HTTP code 503
+    """
+    if isinstance(markets, int):
+      markets = ['m%03duah' % i for i in range(markets)]
+    self.markets = {name: StubMarket(name, rate=rate) for name in markets}
+    self.depth = depth
+    self.trades = trades
+    self.latency = latency
+    self.jitter = jitter
+    self.errors = errors
+    self.orders = {}
+    self.order_id = 0
+    self.lock = threading.Lock()
+    self.served = collections.Counter()
+
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        stub.handle(self)
+
+      def do_POST(self):
+        stub.handle(self)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.server = ThreadingHTTPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    self.thread = None
+
+  @property
+  def url(self):
+    """
+    str: base URL of the server
+    """
+    host, port = self.server.server_address[:2]
+    return 'http://%s:%d' % (host, port)
+
+  def start(self):
+    """
+    Starts serving in a background thread.
+
+    Returns:
+      StubServer: self
+    """
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    """
+    Void method that stops the server.
+    """
+    self.server.shutdown()
+    self.server.server_close()
+
+  def handle(self, request):
+    """
+    Void method that answers a request.
+
+    Args:
+      request (http.server.BaseHTTPRequestHandler): the request
+    """
+    url = urlsplit(request.path)
+    args = dict(parse_qsl(url.query))
+    length = int(request.headers.get('content-length') or 0)
+    body = request.rfile.read(length) if length else b''
+    # kunaio sends arguments of GET requests in the body
+    if body:
+      try:
+        args.update(json.loads(body))
+      except ValueError:
+        args.update(parse_qsl(body.decode()))
+
+    delay = self.latency + self.jitter * random.random()
+    if delay > 0:
+      time.sleep(delay)
+
+    path = url.path
+    if random.random() < self.errors:
+      code, response = 503, {'messages': ['stub error']}
+    elif path.startswith('/v3/'):
+      code, response = self.v3(path[4:], args)
+    elif path.startswith('/api/v2/'):
+      code, response = self.v2(path[8:], args)
+    else:
+      code, response = 404, {'messages': ['not_found']}
+    with self.lock:
+      self.served[path if code == 200 else code] += 1
+
+    payload = json.dumps(response).encode()
+    request.send_response(code)
+    request.send_header('content-type', 'application/json')
+    request.send_header('content-length', str(len(payload)))
+    request.end_headers()
+    request.wfile.write(payload)
+
+  def _market(self, name):
+    market = self.markets.get(name)
+    if market is None:
+      return 404, {'messages': ['market_not_found']}
+    return 200, market
+
+  def v3(self, path, args):
+    """
+    Answers a request of the Kuna API v3.
+
+    Returns:
+      tuple: HTTP code and the response
+    """
+    now = time.time()
+    if path == 'timestamp':
+      return 200, {'timestamp': int(now), 'timestamp_miliseconds': int(1000 * now)}
+    if path == 'tickers':
+      symbols = args.get('symbols', 'ALL')
+      names = list(self.markets) if symbols == 'ALL' else symbols.split(',')
+      return 200, [self.markets[name].ticker() for name in names
+                   if name in self.markets]
+    if path.startswith('book/'):
+      code, market = self._market(path[5:])
+      return (code, market.book(self.depth)) if code == 200 else (code, market)
+    if path == 'currencies':
+      names = sorted({name[:-3] for name in self.markets} | {'uah'})
+      return 200, [{'id': i, 'code': name, 'name': name.upper(),
+                    'has_memo': False, 'fees': {}, 'precision': {'real': 6},
+                    'coin': True} for i, name in enumerate(names)]
+    if path == 'markets':
+      return 200, [{'id': name, 'base_unit': name[:-3], 'quote_unit': name[-3:],
+                    'base_precision': 6, 'quote_precision': 2}
+                   for name in self.markets]
+    if path == 'fees':
+      return 200, []
+    if path in ('http_test', 'auth/me'):
+      return 200, {'email': 'stub@localhost', 'kunaid': 'stub', 'public_keys': {}}
+    if path == 'auth/r/wallets':
+      return 200, [['exchange', name, 1000., None, 1000.]
+                   for name in sorted({name[:-3] for name in self.markets} | {'uah'})]
+    if path == 'auth/history/trades':
+      return 200, {}
+    if path == 'auth/w/order/submit':
+      return 200, self.submit(args)
+    if path == 'order/cancel':
+      return self.cancel(args.get('order_id'))
+    if path.startswith('auth/r/orders'):
+      parts = path.split('/')[3:]
+      hist = bool(parts) and parts[-1] == 'hist'
+      market = parts[0] if parts and parts[0] != 'hist' else None
+      with self.lock:
+        orders = [list(order) for order in self.orders.values()]
+      orders = [order for order in orders
+                if (order[13] != 'ACTIVE') == hist
+                and (market is None or order[3] == market)]
+      if not hist:
+        return 200, orders
+      # the history is filtered by the update time as on kuna.io
+      moment = int(1000 * now)
+      start = int(args.get('start') or moment - 14 * 86400000)
+      end = int(args.get('end') or moment)
+      orders = [order for order in orders if start <= order[5] <= end]
+      orders.sort(key=lambda order: (order[5], order[0]),
+                  reverse=int(args.get('sort') or -1) < 0)
+      return 200, orders[:min(int(args.get('limit') or 25), 100)]
+    if path.startswith('auth/r/order/') and path.endswith('/trades'):
+      return 200, []
+    return 404, {'messages': ['not_found']}
+
+  def submit(self, args):
+    """
+    Returns:
+      list: the new active order in the positional format
+    """
+    now = int(1000 * time.time())
+    with self.lock:
+      self.order_id += 1
+      amount = str(args.get('amount'))
+      order = [self.order_id, None, None, args.get('symbol'), now, now, amount,
+               amount, str(args.get('type', 'limit')).upper(), None, None, None,
+               None, 'ACTIVE', None, None, str(args.get('price')), '0', None,
+               args.get('stop_price') and str(args.get('stop_price')), None, None, None, None, None]
+      self.orders[self.order_id] = order
+    return order
+
+  def cancel(self, order_id):
+    """
+    Returns:
+      tuple: HTTP code and the canceled order in the named format
+    """
+    with self.lock:
+      order = self.orders.get(order_id)
+      if order is None:
+        return 404, {'messages': ['order_not_found']}
+      order[13] = 'CANCELED'
+      order[5] = int(1000 * time.time())
+    amount = float(order[7])
+    return 200, {
+      'id': order[0],
+      'side': 'buy' if amount > 0 else 'sell',
+      'type': order[8].lower(),
+      'price': order[16],
+      'avg_execution_price': '0',
+      'state': 'canceled',
+      'symbol': order[3],
+      'timestamp': order[5],
+      'original_amount': str(abs(amount)),
+      'remaining_amount': str(abs(amount)),
+      'executed_amount': '0',
+      'is_cancelled': None,
+      'is_hidden': None,
+      'is_live': None,
+      'was_forced': None,
+      'exchange': None,
+    }
+
+  def v2(self, path, args):
+    """
+    Answers a request of the Kuna API v2.
+
+    Returns:
+      tuple: HTTP code and the response
+    """
+    if path == 'timestamp':
+      return 200, int(time.time())
+    if path == 'tickers' or path.startswith('tickers/'):
+      tickers = {}
+      for name, market in self.markets.items():
+        row = market.ticker()
+        tickers[name] = {'at': int(time.time()), 'ticker': {
+          'buy': str(row[1]), 'sell': str(row[3]), 'low': str(row[10]),
+          'high': str(row[9]), 'last': str(row[7]), 'vol': str(row[8]),
+          'price': str(row[7] * row[8]),
+        }}
+      if path == 'tickers':
+        return 200, tickers
+      name = path[8:]
+      return (200, tickers[name]) if name in tickers else \
+        (404, {'error': {'code': 2, 'message': 'market_not_found'}})
+    if path == 'depth':
+      code, market = self._market(args.get('market'))
+      if code != 200:
+        return code, market
+      book = market.book(self.depth)
+      return 200, {
+        'timestamp': int(time.time()),
+        'asks': [[str(p), str(-v)] for p, v, _ in book if v < 0],
+        'bids': [[str(p), str(v)] for p, v, _ in book if v > 0],
+      }
+    if path == 'trades':
+      code, market = self._market(args.get('market'))
+      if code != 200:
+        return code, market
+      since = args.get('from')
+      if since is None:
+        return 200, market.history(limit=self.trades)
+      return 200, market.history(
+        since=int(since), limit=int(args.get('limit', self.trades)),
+        ascending=args.get('order_by') == 'asc')
+    return 404, {'error': {'code': 2, 'message': 'not_found'}}
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(description='Imitates the Kuna API locally')
+  parser.add_argument('--host', default='127.0.0.1', help='address to listen')
+  parser.add_argument('--port', type=int, default=8080, help='port to listen')
+  parser.add_argument('--markets', type=int, default=10, help='amount of markets')
+  parser.add_argument('--rate', type=float, default=1.,
+    help='trades per second of each market')
+  parser.add_argument('--depth', type=int, default=50,
+    help='levels of each side of an order book')
+  parser.add_argument('--trades', type=int, default=100,
+    help='trades in a response of the v2 trades endpoint')
+  parser.add_argument('--latency', type=float, default=0.,
+    help='delay of each response in seconds')
+  parser.add_argument('--jitter', type=float, default=0.,
+    help='maximum random addition to the delay in seconds')
+  parser.add_argument('--errors', type=float, default=0.,
+    help='share of failed responses')
+  args = parser.parse_args()
+  stub = StubServer(args.host, args.port, args.markets, args.rate, args.depth,
+                    args.trades, args.latency, args.jitter, args.errors)
+  print('Serving the Kuna API at %s/v3/ and %s/api/v2/' % (stub.url, stub.url))
+  stub.server.serve_forever()
@@ -0,0 +1,25 @@
+import datetime
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('requests')
+
+from exchangerate import ExchangeRate
+
+def test_convert(tmp_path):
+  rates = ExchangeRate({'USD'}, storage=str(tmp_path / 'rates.db'))
+  rates._write_rates_(datetime.date(2022, 3, 1), {'USD': 30.})
+  rates._write_rates_(datetime.date(2022, 3, 3), {'USD': 40.})
+  frame = pd.DataFrame({
+    # 2 March takes the rate of 1 March, the order of deals is kept
+    'time': [
+      pd.Timestamp('2022-03-03 12:00').timestamp(),
+      pd.Timestamp('2022-03-01 12:00').timestamp(),
+      pd.Timestamp('2022-03-02 12:00').timestamp(),
+    ],
+    'price': [400., 300., 600.],
+  }, index=[10, 11, 12])
+  converted = rates.convert(frame, 'USD')
+  assert list(converted.index) == [10, 11, 12]
+  assert converted.tolist() == [10., 10., 20.]
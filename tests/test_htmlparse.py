@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import htmlparse
+
+def _cells(rows):
+  return [[(tag, text.strip()) for tag, attrs, text in row] for row in rows]
+
+def _parsed(name, tag, classes):
+  with open(os.path.join(htmlparse.FIXTURES, name), 'rb') as f:
+    content = f.read()
+  parsed = {}
+  for backend, function in htmlparse._BACKENDS_:
+    try:
+      parsed[backend] = _cells(htmlparse.table_rows(content, tag, classes,
+                                                    backend))
+    except ImportError:
+      continue
+  if not parsed:
+    pytest.skip('no parser backend is available')
+  return parsed
+
+def test_nbu_rates():
+  for backend, rows in _parsed('nbu_rates.html', 'table', ()).items():
+    codes = [row[1][1] for row in rows if row and row[0][0] == 'td']
+    assert len(codes) == 21, backend
+    assert 'USD' in codes and 'XXX' not in codes, backend
+
+@pytest.mark.parametrize('classes', [
+  ('idx-block-1120', 'compact-table'),
+  ('compact-table', 'idx-block-1120'),
+])
+def test_inflation_classes(classes):
+  parsed = _parsed('inflation.html', 'div', classes)
+  for backend, rows in parsed.items():
+    # the block with both classes, not the first one with a single class
+    assert len([cell for cell in rows[0] if cell[0] == 'th']) == 14, backend
+    assert rows[1][0] == ('th', '2000'), backend
+    assert len(rows) == 23, backend
+  # all backends extract the same cells
+  assert len({repr(rows) for rows in parsed.values()}) == 1
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import kunaio
+from stubserver import StubServer
+
+KEYS = {'public': 'public', 'private': 'private'}
+
+@pytest.fixture
+def stub(monkeypatch):
+  server = StubServer(markets=['btcuah']).start()
+  monkeypatch.setattr(kunaio, 'DOMAIN', server.url + '/v3/')
+  yield server
+  server.stop()
+
+def test_submit_batch(stub):
+  placed = kunaio.submit_batch(KEYS, orders=[
+    {'market': 'btcuah', 'order_type': 'limit', 'amount': 1, 'price': 100},
+    {'market': 'btcuah', 'order_type': 'limit', 'amount': -1, 'price': 110},
+  ])
+  assert [o['error'] for o in placed['orders']] == [None, None]
+  IDs = [o['result'][0] for o in placed['orders']]
+  assert [o['intent']['price'] for o in placed['orders']] == [100, 110]
+
+  result = kunaio.submit_batch(KEYS, cancels=[IDs[0], 12345], rate=5)
+  assert result['cancels'][0]['error'] is None
+  assert result['cancels'][0]['result']['id'] == IDs[0]
+  # an error answer of the API is reported as an error
+  assert result['cancels'][1]['result'] is None
+  assert 'order_not_found' in result['cancels'][1]['error']
+  # the rate of the batch does not change the limit of the key pair
+  assert kunaio.get_signer(KEYS).limiter.rate == kunaio.RATE_LIMIT
+
+  active = kunaio.get_user_active(KEYS, typed=True)
+  assert [order.id for order in active] == [IDs[1]]